@@ -1,20 +1,89 @@
-from fastapi import FastAPI, Depends, HTTPException, Request, Response, status
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import jwt
 import os
 from typing import Dict, List, Literal, Optional
 import time
+import asyncio
+import base64
+import hashlib
+import json
 import httpx
-from microsoft import MS_GRAPH_BASE_URL
+from contextlib import asynccontextmanager
+from extraction import warm_up_classifier, shutdown_classifier
+from db import init_engine, dispose_engine
+from ttl_cache import TTLCache
+from microsoft import MS_GRAPH_BASE_URL, close_graph_client
+from token_store import get_token_store
+from jobs import FINISHED_STATES, get_job_queue, shutdown_job_queue
 
 # Replace these with your own values
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
 JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY", "supersecret")
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRE_SECONDS = 3600
+# How often the classification event stream checks for new events and sends stats
+CLASSIFY_STREAM_POLL_SECONDS = float(os.getenv("CLASSIFY_STREAM_POLL_SECONDS", "0.2"))
+CLASSIFY_STREAM_STATS_SECONDS = float(os.getenv("CLASSIFY_STREAM_STATS_SECONDS", "1.0"))
+GOOGLE_USERINFO_URL = "https://www.googleapis.com/oauth2/v3/userinfo"
+# Profiles looked up with the same access token within this window are reused
+PROFILE_CACHE_SECONDS = float(os.getenv("PROFILE_CACHE_SECONDS", "300"))
 
-app = FastAPI()
+# One pooled client for identity calls (Google userinfo, Graph /me), so
+# logins reuse warm TLS connections
+_identity_client: Optional[httpx.AsyncClient] = None
+
+def get_identity_client() -> httpx.AsyncClient:
+    global _identity_client
+    if _identity_client is None:
+        _identity_client = httpx.AsyncClient(
+            http2=True,
+            timeout=httpx.Timeout(10.0),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        )
+    return _identity_client
+
+async def close_identity_client():
+    global _identity_client
+    client, _identity_client = _identity_client, None
+    if client is not None:
+        await client.aclose()
+
+# Successful profile lookups keyed by (URL, SHA-256 of the access token); the
+# raw token is never used as a key
+profile_cache = TTLCache(maxsize=1024, ttl=PROFILE_CACHE_SECONDS)
+
+async def fetch_profile(url: str, access_token: str) -> Optional[dict]:
+    """GET an identity profile with access_token, or None if it's rejected."""
+    key = (url, hashlib.sha256(access_token.encode()).hexdigest())
+    profile = profile_cache.get(key)
+    if profile is not None:
+        return profile
+    resp = await get_identity_client().get(url, headers={"Authorization": f"Bearer {access_token}"})
+    if resp.status_code != 200:
+        return None
+    profile = resp.json()
+    profile_cache.set(key, profile)
+    return profile
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One database engine per process; schema migrations run here, once
+    await asyncio.to_thread(init_engine)
+    # Build the LLM client and open its connection pool before the first request
+    await asyncio.to_thread(warm_up_classifier)
+    # Opening the job store flags jobs a previous process left unfinished
+    await asyncio.to_thread(get_job_queue)
+    yield
+    await asyncio.to_thread(shutdown_job_queue)
+    await asyncio.to_thread(shutdown_classifier)
+    await asyncio.to_thread(close_graph_client)
+    await close_identity_client()
+    await asyncio.to_thread(dispose_engine)
+
+app = FastAPI(lifespan=lifespan)
 
 # 1. CORS middleware (allow frontend origin with credentials)
 origins = [
@@ -26,12 +95,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "OPTIONS"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
 
 # 2. Schemas for request bodies
 # In app.py
-user_gmail_token_store: dict[str, str] = {}
-user_microsoft_token_store: dict[str,str] = {}
+user_gmail_token_store = get_token_store("google")
+user_microsoft_token_store = get_token_store("microsoft")
 
 class GoogleLoginPayload(BaseModel):
     access_token: str
@@ -44,14 +114,9 @@ class ClassifyPayload(BaseModel):
 @app.post("/auth/google")
 async def auth_google(payload: GoogleLoginPayload, response: Response):
     # 1) Use access_token to get user info from Google API
-    async with httpx.AsyncClient() as client:
-        userinfo_response = await client.get(
-            "https://www.googleapis.com/oauth2/v3/userinfo",
-            headers={"Authorization": f"Bearer {payload.access_token}"}
-        )
-    if userinfo_response.status_code != 200:
+    id_info = await fetch_profile(GOOGLE_USERINFO_URL, payload.access_token)
+    if id_info is None:
         raise HTTPException(status_code=400, detail="Invalid access token.")
-    id_info = userinfo_response.json()
 
     google_user_id = id_info.get("sub")
     email = id_info.get("email")
@@ -77,7 +142,7 @@ async def auth_google(payload: GoogleLoginPayload, response: Response):
     )
 
     # 3) Store the user’s Gmail access token so we can call Gmail API later
-    user_gmail_token_store[google_user_id] = payload.access_token
+    user_gmail_token_store.set(google_user_id, payload.access_token)
 
     return {"email": email}
 
@@ -104,6 +169,11 @@ from fastapi import Header
 
 # Example dependency:
 def get_current_user(request: Request):
+    # The verified payload is kept on the request, so the JWT is decoded once
+    # however many dependencies and handlers ask for it
+    payload = getattr(request.state, "auth", None)
+    if payload is not None:
+        return payload
     token = request.cookies.get("token")
     if not token:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
@@ -111,49 +181,91 @@ def get_current_user(request: Request):
         payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
     except jwt.PyJWTError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
-    return payload  # contains "sub" and "email"
+    request.state.auth = payload
+    return payload  # contains "user_id" and "email"
 
 
 # 5. Protected GET /applications_by_status
+# Responses keyed by (data version, limit, cursor). A classification run that
+# writes rows bumps the version, so stale entries are never served and simply
+# age out of the LRU.
+applications_cache = TTLCache(maxsize=256, ttl=3600)
+
+def _encode_cursor(cursors: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(cursors, sort_keys=True).encode()).decode()
+
+def _decode_cursor(cursor: str) -> dict:
+    try:
+        cursors = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    from classify import STATUSES
+    # Only our own cursors are accepted: one job_id string per known status
+    if not isinstance(cursors, dict) or not all(
+        status in STATUSES and isinstance(after, str) for status, after in cursors.items()
+    ):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    return cursors
+
 @app.get("/applications_by_status", dependencies=[Depends(get_current_user)])
-async def applications_by_status():
+async def applications_by_status(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = None,
+):
     """
     This endpoint should already call get_applications_by_status() 
     and return a dictionary. Just ensure it's protected.
+
+    With `limit`, each status returns at most that many rows and the
+    X-Next-Cursor header carries the cursor for the next page. The ETag
+    changes only when a classification run writes rows.
     """
-    from classify import get_applications_by_status
-    return get_applications_by_status()
+    from classify import get_applications_page, get_applications_version
+    cursors = _decode_cursor(cursor) if cursor else None
+    version = await asyncio.to_thread(get_applications_version)
+    key = (version, limit, cursor)
+    etag = f'W/"{version}-{hashlib.sha256(repr(key).encode()).hexdigest()[:16]}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    page = applications_cache.get(key)
+    if page is None:
+        page = await asyncio.to_thread(get_applications_page, limit, cursors)
+        applications_cache.set(key, page)
+    result_dict, next_cursors = page
+
+    response.headers.update(headers)
+    if next_cursors:
+        response.headers["X-Next-Cursor"] = _encode_cursor(next_cursors)
+    return result_dict
 
 
 # 6. Protected POST /classify
-@app.post("/classify", dependencies=[Depends(get_current_user)])
-async def classify_emails(classify_in:ClassifyPayload,request: Request):
+@app.post("/classify", status_code=status.HTTP_202_ACCEPTED)
+async def classify_emails(classify_in:ClassifyPayload, user: dict = Depends(get_current_user)):
     """
-    Decode our session JWT, look up the user's Gmail access_token, and
-    pass that token into classification(...).
+    Look up the user's access token(s), and queue a
+    classification(...) run in the background. Returns the job ID to poll
+    at GET /classify/{job_id}.
     """
-     # 1) Read & decode our session JWT from the cookie
-    token = request.cookies.get("token")
-    if not token:
-        raise HTTPException(401, "Not authenticated.")
-    try:
-        token_data = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
-    except jwt.PyJWTError:
-        raise HTTPException(401, "Invalid or expired session token.")
-    user_id = token_data["user_id"]
+    # 1) Our session JWT was already verified by get_current_user
+    user_id = user["user_id"]
 
     # 2) Determine which provider(s) to use from the request body
     provider = classify_in.provider.lower()
     if provider == "google":
         if classify_in.access_token:
-            user_gmail_token_store[user_id] = classify_in.access_token
+            user_gmail_token_store.set(user_id, classify_in.access_token)
         access_token = user_gmail_token_store.get(user_id)
         if not access_token:
             raise HTTPException(400, "Google token not found; please re-login.")
     elif provider == "microsoft":
         # If the client sent an inline MS token (e.g. on first login), store it:
         if classify_in.access_token:
-            user_microsoft_token_store[user_id] = classify_in.access_token
+            user_microsoft_token_store.set(user_id, classify_in.access_token)
         access_token = user_microsoft_token_store.get(user_id)
         if not access_token:
             raise HTTPException(400, "Microsoft token missing; please login with Microsoft.")
@@ -163,17 +275,109 @@ async def classify_emails(classify_in:ClassifyPayload,request: Request):
         m = user_microsoft_token_store.get(user_id)
         if not g or not m:
             raise HTTPException(400, "Both tokens required; please login to both providers.")
-        access_token = None  # classification() will handle both internally
+        access_token = g
     else:
         raise HTTPException(400, f"Unknown provider '{provider}'.")
 
-    # 3) Call your classification() logic
+    # 3) Queue your classification() logic
     from classify import classification
-    # If you pass `access_token=None` and provider="both", your classify()
-    # will fetch from both services.
-    classification(access_token, provider=provider)
+    # With provider="both" the Gmail token is passed as access_token and the
+    # Microsoft token separately; classification() fetches both concurrently.
+    microsoft_access_token = user_microsoft_token_store.get(user_id) if provider == "both" else None
 
-    return {"status": "classification complete", "provider": provider}
+    def run(progress, emit):
+        return classification(
+            access_token,
+            provider=provider,
+            user_id=user_id,
+            microsoft_access_token=microsoft_access_token,
+            progress=progress,
+            emit=emit,
+        )
+
+    # A double-click or second tab joins the run already in flight instead
+    # of starting another one
+    job_id, coalesced = await asyncio.to_thread(get_job_queue().submit, user_id, provider, run)
+    job = await asyncio.to_thread(get_job_queue().get, job_id)
+    return {"job_id": job_id, "state": job["state"], "provider": provider, "coalesced": coalesced}
+
+
+@app.get("/classify/{job_id}")
+async def classify_status(job_id: str, user: dict = Depends(get_current_user)):
+    """
+    Report a classification job's state (queued, running, succeeded, failed
+    or interrupted), its current stage and progress counts, and its result
+    or error once finished.
+    """
+    job = await asyncio.to_thread(get_job_queue().get, job_id)
+    # Other users' jobs are reported as missing rather than forbidden
+    if job is None or job["user_id"] != user["user_id"]:
+        raise HTTPException(404, "Classification job not found.")
+    return {
+        "job_id": job["job_id"],
+        "provider": job["provider"],
+        "state": job["state"],
+        "stage": job["stage"],
+        "progress": job["progress"],
+        "result": job["result"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
+
+
+def _sse(event: str, data: dict, event_id: int = None) -> str:
+    lines = [] if event_id is None else [f"id: {event_id}"]
+    lines += [f"event: {event}", f"data: {json.dumps(data, default=str)}"]
+    return "\n".join(lines) + "\n\n"
+
+
+@app.get("/classify/{job_id}/events")
+async def classify_events(job_id: str, request: Request, user: dict = Depends(get_current_user)):
+    """
+    Stream a classification job as Server-Sent Events: one event per email
+    as it moves through the pipeline (fetched, skipped, template, classified,
+    failed, upserted), stage changes, a "stats" event with throughput every
+    CLASSIFY_STREAM_STATS_SECONDS, and a final "end" event with the job's
+    state. Reconnecting clients resume after their Last-Event-ID.
+    """
+    queue = get_job_queue()
+    job = await asyncio.to_thread(queue.get, job_id)
+    if job is None or job["user_id"] != user["user_id"]:
+        raise HTTPException(404, "Classification job not found.")
+    try:
+        last_id = int(request.headers.get("last-event-id", "0"))
+    except ValueError:
+        last_id = 0
+
+    async def stream():
+        nonlocal last_id, job
+        log = queue.events(job_id)
+        next_stats = time.monotonic()
+        while True:
+            # Read the state before draining, so no event appended after the
+            # job finished can be missed
+            finished = job["state"] in FINISHED_STATES
+            if log is not None:
+                for entry in log.since(last_id):
+                    last_id = entry["id"]
+                    yield _sse(entry["event"], entry["data"], event_id=entry["id"])
+                if time.monotonic() >= next_stats or finished:
+                    yield _sse("stats", log.stats())
+                    next_stats = time.monotonic() + CLASSIFY_STREAM_STATS_SECONDS
+            if finished:
+                yield _sse("end", {"state": job["state"], "result": job["result"], "error": job["error"]})
+                return
+            if await request.is_disconnected():
+                return
+            await asyncio.sleep(CLASSIFY_STREAM_POLL_SECONDS)
+            job = await asyncio.to_thread(queue.get, job_id)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 # 7. Logging out of the application
 @app.post("/auth/logout")
@@ -187,14 +391,9 @@ class MicrosoftLoginPayload(BaseModel):
 @app.post("/auth/microsoft")
 async def auth_microsoft(payload: MicrosoftLoginPayload, response: Response):
     # 1) Validate the Microsoft access token via Graph /me
-    async with httpx.AsyncClient() as client:
-        me_resp = await client.get(
-            f"{MS_GRAPH_BASE_URL}/me",
-            headers={"Authorization": f"Bearer {payload.access_token}"}
-        )
-    if me_resp.status_code != 200:
+    profile = await fetch_profile(f"{MS_GRAPH_BASE_URL}/me", payload.access_token)
+    if profile is None:
         raise HTTPException(status_code=400, detail="Invalid Microsoft access token.")
-    profile = me_resp.json()
     ms_user_id = profile.get("id")
     email = profile.get("mail") or profile.get("userPrincipalName")
     if not ms_user_id or not email:
@@ -218,6 +417,6 @@ async def auth_microsoft(payload: MicrosoftLoginPayload, response: Response):
     )
 
     # 3) Store the raw MS token for later classification
-    user_microsoft_token_store[ms_user_id] = payload.access_token
+    user_microsoft_token_store.set(ms_user_id, payload.access_token)
 
     return {"email": email}
\ No newline at end of file
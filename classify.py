@@ -1,41 +1,259 @@
 from gmail_auth import build_user_gmail_service
-from utils import download_emails_google, download_outlook_emails, extract_emails, normalize_to_date, initialize_db
-import os
-from tqdm import tqdm
+from utils import (
+    download_emails_google,
+    download_outlook_emails,
+    extract_emails,
+    save_sync_cursor,
+    get_dead_letters,
+    save_dead_letters,
+)
+from dates import normalize_dates
+from db import get_engine, get_data_version, bump_data_version
+from threads import latest_per_thread
+from extraction import STATUS_DATE_FIELDS
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import time
 from sqlalchemy import text
 from dotenv import load_dotenv
 import uuid
+from datetime import date
 
 load_dotenv()
 
-def classification(access_token: str, provider: str = "google"):
-    DATABASE_URL = os.getenv("DATABASE_URL")
-    os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY")
-    engine = initialize_db(DATABASE_URL)
+def _timed_download(name, download):
+    start = time.perf_counter()
+    try:
+        (emails, cursor), error = download(), None
+    except Exception as e:
+        emails, cursor, error = [], None, e
+    return name, emails, cursor, error, time.perf_counter() - start
+
+def download_concurrently(downloads: dict):
+    """
+    Run each provider download (name -> zero-arg callable returning
+    (emails, new_cursor)) in its own thread and yield (name, emails, cursor,
+    error, seconds) as each one finishes, so a slow provider never holds back
+    another provider's messages.
+    """
+    with ThreadPoolExecutor(max_workers=len(downloads)) as pool:
+        futures = [pool.submit(_timed_download, name, download) for name, download in downloads.items()]
+        for future in as_completed(futures):
+            yield future.result()
+
+UPSERT_BATCH_SIZE = 500
+
+# One statement for insert-or-update on the (company_name, job_title) key.
+# On conflict each date column takes the batch's date for that status
+# (status_<column>, NULL when no email in the batch reported that status or
+# it came without a date) and otherwise keeps its value; unknown statuses
+# leave the status untouched. Works on SQLite >= 3.24 and PostgreSQL.
+UPSERT_APPLICATION_SQL = text("""
+    INSERT INTO job_applications (job_id, date_applied, company_name, job_title, application_status, date_rejected, interview_date, offer_date)
+    VALUES (:job_id, :date_applied, :company_name, :job_title, :application_status, :date_rejected, :interview_date, :offer_date)
+    ON CONFLICT (company_name, job_title) DO UPDATE SET
+        date_applied = COALESCE(:status_date_applied, job_applications.date_applied),
+        date_rejected = COALESCE(:status_date_rejected, job_applications.date_rejected),
+        interview_date = COALESCE(:status_interview_date, job_applications.interview_date),
+        offer_date = COALESCE(:status_offer_date, job_applications.offer_date),
+        application_status = CASE WHEN excluded.application_status IN ('Applied', 'Rejected', 'Interview', 'Offer')
+            THEN excluded.application_status ELSE job_applications.application_status END
+""")
+
+def _merge_application_rows(items) -> list[dict]:
+    """
+    Build one parameter row per (company_name, job_title); a single
+    executemany batch may not touch the same key twice on PostgreSQL.
+
+    Each status's date comes from the emails reporting that status (the last
+    non-null one wins), so an "Applied" and an "Interview" email in the same
+    run both keep their dates. The row's status is the one with the latest
+    date, ties and undated statuses going to the later email. A new key is
+    inserted with the first email's other dates as well.
+    """
+    groups: dict = {}
+    unkeyed = []
+    # Parse every date in the run at once; repeated values are parsed once
+    for item in normalize_dates(items):
+        row = {
+            "job_id": str(uuid.uuid4()),
+            "company_name": item.get('company_name'),
+            "job_title": item.get('job_title'),
+            "application_status": item.get('application_status'),
+            "date_applied": item.get('date_applied'),
+            "date_rejected": item.get('date_rejected'),
+            "interview_date": item.get('interview_date'),
+            "offer_date": item.get('offer_date'),
+        }
+        if row["company_name"] is None or row["job_title"] is None:
+            # NULL keys never conflict, so each of these is its own row
+            unkeyed.append(row)
+            continue
+        groups.setdefault((row["company_name"], row["job_title"]), []).append(row)
+
+    rows = []
+    for group in list(groups.values()) + [[row] for row in unkeyed]:
+        merged = dict(group[0])
+        status_dates = {f"status_{field}": None for field in STATUS_DATE_FIELDS.values()}
+        latest = None
+        for position, row in enumerate(group):
+            date_field = STATUS_DATE_FIELDS.get(row["application_status"])
+            if date_field is None:
+                continue
+            if row[date_field] is not None:
+                status_dates[f"status_{date_field}"] = row[date_field]
+                merged[date_field] = row[date_field]
+            rank = (row[date_field] or date.min, position)
+            if latest is None or rank >= latest[0]:
+                latest = (rank, row["application_status"])
+        if latest is not None:
+            merged["application_status"] = latest[1]
+        merged.update(status_dates)
+        rows.append(merged)
+    return rows
+
+def upsert_applications(conn, items) -> list[dict]:
+    """Upsert items and return the rows written, one per application."""
+    rows = _merge_application_rows(items)
+    for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+        conn.execute(UPSERT_APPLICATION_SQL, rows[start:start + UPSERT_BATCH_SIZE])
+    return rows
+
+def _ignore_progress(stage, **counts):
+    pass
+
+def _ignore_event(event, **data):
+    pass
+
+def _email_ref(email, provider: str) -> dict:
+    """The fields identifying an email in streamed events."""
+    if not isinstance(email, dict):
+        return {"provider": provider}
+    return {
+        "provider": provider,
+        "email_id": email.get("id"),
+        "subject": email.get("subject"),
+        "sender": email.get("sender"),
+    }
+
+def _with_dead_letters(engine, user_id: str, provider: str, conversations: list):
+    """
+    Add the emails that failed extraction on earlier runs to conversations,
+    unless a newer message of the same thread is already there. Returns
+    (conversations, retried_message_ids).
+    """
+    if not user_id:
+        return conversations, []
+    retry = get_dead_letters(engine, user_id, provider)
+    if not retry:
+        return conversations, []
+    present = {email.get("thread_id") or email.get("id") for email in conversations}
+    extra = [email for email in retry if (email.get("thread_id") or email.get("id")) not in present]
+    print(f"Retrying {len(extra)} {provider} emails that failed extraction before")
+    return conversations + extra, [email["id"] for email in retry]
+
+def _classify_conversations(conversations, provider: str, dead_letters: list, emit) -> list:
+    """
+    extract_emails(...), emitting an event per email as its verdict lands.
+    Failed emails are appended to dead_letters with their provider and
+    message ID, ready for save_dead_letters.
+    """
+    for email in conversations:
+        emit("fetched", **_email_ref(email, provider))
+
+    def _on_event(index, outcome, result):
+        ref = _email_ref(conversations[index], provider)
+        if outcome in ("cached", "filtered"):
+            emit("skipped", reason=outcome, result=result, **ref)
+        else:
+            emit(outcome, result=result, **ref)
+
+    failed = []
+    data = extract_emails(conversations, dead_letters=failed, on_event=_on_event)
+    for letter in failed:
+        email = conversations[letter["index"]]
+        dead_letters.append({
+            "provider": provider,
+            "message_id": email.get("id"),
+            "email": email,
+            "error": letter["error"],
+        })
+    return data
+
+def classification(access_token: str, provider: str = "google", user_id: str = None, microsoft_access_token: str = None, progress=None, emit=None):
+    """
+    Download, classify and upsert a user's job emails.
+
+    progress(stage, **counts), if given, is called as the run moves through
+    its stages (downloading, classifying, upserting, done). emit(event,
+    **data), if given, is called per email: "fetched", then "skipped" (cache
+    hit or prefilter drop), "template", "classified" or "failed", and
+    "upserted" per application once written. Returns a summary of the run's
+    counts.
+    """
+    progress = progress or _ignore_progress
+    emit = emit or _ignore_event
+    engine = get_engine()
     emails: list[str] = []
+    # New sync cursors per provider, saved only with the upserted results
+    cursors: dict[str, str] = {}
+    # Download seconds per provider, reported with the progress and summary
+    timings: dict[str, float] = {}
+    progress("downloading")
+    start = time.perf_counter()
     if provider.lower() == "google":
         print("Using Google provider")
         service = build_user_gmail_service(access_token)
-        emails = download_emails_google(service, 2)
-        print(f"Downloaded {len(emails)} Gmail messages")
+        emails, cursors["google"] = download_emails_google(service, 2, engine=engine, user_id=user_id)
+        timings["google"] = round(time.perf_counter() - start, 2)
+        print(f"Downloaded {len(emails)} Gmail messages in {timings['google']:.1f}s")
     elif provider.lower() == "microsoft":
         print("Using Microsoft provider")
-        emails = download_outlook_emails()
-        print(f"Downloaded {len(emails)} Outlook messages")
+        emails, cursors["microsoft"] = download_outlook_emails(access_token, engine=engine, user_id=user_id)
+        timings["microsoft"] = round(time.perf_counter() - start, 2)
+        print(f"Downloaded {len(emails)} Outlook messages in {timings['microsoft']:.1f}s")
     elif provider.lower() == "both":
         print("Using both Google and Microsoft providers")
-        service = build_user_gmail_service(access_token)
-        gmail_msgs = download_emails_google(service, 2)
-        print(f"Downloaded {len(gmail_msgs)} Gmail messages")
-        outlook_msgs = download_outlook_emails()
-        print(f"Downloaded {len(outlook_msgs)} Outlook messages")
-        emails = gmail_msgs + outlook_msgs
-        print(f"Total combined messages: {len(emails)}")
     else:
         raise ValueError(f"Unknown provider: {provider}")
 
     # Extracting Job Application Emails
-    data = extract_emails(emails)
+    # Emails whose extraction failed are collected here instead of aborting the
+    # run, then stored so the next run retries them
+    dead_letters: list[dict] = []
+    # Message IDs of earlier dead letters retried this run, per provider
+    retried: dict[str, list] = {}
+    provider_errors: dict[str, str] = {}
+    downloaded = classified = 0
+    if provider.lower() == "both":
+        # Classify each provider's messages as soon as its download finishes
+        data = []
+        downloads = {
+            "google": lambda: download_emails_google(build_user_gmail_service(access_token), 2, engine=engine, user_id=user_id),
+            "microsoft": lambda: download_outlook_emails(microsoft_access_token, engine=engine, user_id=user_id),
+        }
+        for name, provider_emails, cursor, error, seconds in download_concurrently(downloads):
+            timings[name] = round(seconds, 2)
+            if error is not None:
+                print(f"{name} download failed after {seconds:.1f}s: {error}")
+                provider_errors[name] = str(error)
+                continue
+            print(f"Downloaded {len(provider_emails)} {name} messages in {seconds:.1f}s")
+            cursors[name] = cursor
+            conversations, retried[name] = _with_dead_letters(engine, user_id, name, latest_per_thread(provider_emails))
+            print(f"{len(conversations)} {name} conversations to classify")
+            downloaded += len(provider_emails)
+            classified += len(conversations)
+            progress("classifying", downloaded=downloaded, conversations=classified, errors=provider_errors, timings=timings)
+            data.extend(_classify_conversations(conversations, name, dead_letters, emit))
+    else:
+        # Only the newest message of each conversation is classified
+        conversations, retried[provider.lower()] = _with_dead_letters(engine, user_id, provider.lower(), latest_per_thread(emails))
+        print(f"{len(conversations)} conversations to classify")
+        downloaded, classified = len(emails), len(conversations)
+        progress("classifying", downloaded=downloaded, conversations=classified, timings=timings)
+        data = _classify_conversations(conversations, provider.lower(), dead_letters, emit)
+    for letter in dead_letters:
+        print(f"Dead letter: {letter['error']}")
 
     print(f"Number of Job Application emails: {len(data)}")
 
@@ -43,129 +261,110 @@ def classification(access_token: str, provider: str = "google"):
     filtered = [d for d in data if d is not None]
 
     # Upsert each item in filtered into the database
+    progress("upserting", downloaded=downloaded, conversations=classified, extracted=len(filtered))
     with engine.begin() as conn:
-        for item in tqdm(filtered):
-            company = item.get('company_name')
-            title = item.get('job_title')
-            date_applied = normalize_to_date(item.get('date_applied'))
-            application_status = item.get('application_status')
-            date_rejected = normalize_to_date(item.get('date_rejected'))
-            interview_date = normalize_to_date(item.get('interview_date'))
-            offer_date = normalize_to_date(item.get('offer_date'))
-            existing = conn.execute(
-                text("SELECT job_id FROM job_applications WHERE company_name = :company AND job_title = :title"),
-                {"company": company, "title": title}
-            ).fetchone()
-
-            if existing:
-                job_id = existing[0]
-                # Conditional update based on application_status
-                if application_status == "Applied":
-                    conn.execute(text("""
-                        UPDATE job_applications
-                        SET date_applied = :date_applied,
-                            application_status = :application_status
-                        WHERE job_id = :job_id
-                    """), {
-                        "date_applied": date_applied,
-                        "application_status": application_status,
-                        "job_id": job_id
-                    })
-                elif application_status == "Rejected":
-                    conn.execute(text("""
-                        UPDATE job_applications
-                        SET date_rejected = :date_rejected,
-                            application_status = :application_status
-                        WHERE job_id = :job_id
-                    """), {
-                        "date_rejected": date_rejected,
-                        "application_status": application_status,
-                        "job_id": job_id
-                    })
-                elif application_status == "Interview":
-                    conn.execute(text("""
-                        UPDATE job_applications
-                        SET interview_date = :interview_date,
-                            application_status = :application_status
-                        WHERE job_id = :job_id
-                    """), {
-                        "interview_date": interview_date,
-                        "application_status": application_status,
-                        "job_id": job_id
-                    })
-                elif application_status == "Offer":
-                    conn.execute(text("""
-                        UPDATE job_applications
-                        SET offer_date = :offer_date,
-                            application_status = :application_status
-                        WHERE job_id = :job_id
-                    """), {
-                        "offer_date": offer_date,
-                        "application_status": application_status,
-                        "job_id": job_id
-                    })
-            else:
-                job_id = str(uuid.uuid4())
-                params = {
-                    "job_id": job_id,
-                    "date_applied": date_applied,
-                    "company_name": company,
-                    "job_title": title,
-                    "application_status": application_status,
-                    "date_rejected": date_rejected,
-                    "interview_date": interview_date,
-                    "offer_date": offer_date
-                }
-                conn.execute(
-                    text("""
-                    INSERT INTO job_applications (job_id, date_applied, company_name, job_title, application_status, date_rejected, interview_date, offer_date)
-                    VALUES (:job_id, :date_applied, :company_name, :job_title, :application_status, :date_rejected, :interview_date, :offer_date)
-                    """),
-                    params
-                )
+        rows = upsert_applications(conn, filtered)
+        if rows:
+            # Invalidates cached /applications_by_status responses
+            bump_data_version(conn)
+        # Committed together with the results: if anything above failed, the
+        # next sync downloads the same messages again
+        for name, cursor in cursors.items():
+            if cursor and user_id:
+                save_sync_cursor(conn, user_id, name, cursor)
+        if user_id:
+            for name, retried_ids in retried.items():
+                letters = [l for l in dead_letters if l["provider"] == name and l["message_id"]]
+                save_dead_letters(conn, user_id, name, letters, retried_ids)
+    upserted = len(rows)
+    print(f"Upserted {upserted} job applications")
+    for row in rows:
+        emit(
+            "upserted",
+            company_name=row["company_name"],
+            job_title=row["job_title"],
+            application_status=row["application_status"],
+        )
 
     print(filtered)
+    summary = {
+        "downloaded": downloaded,
+        "conversations": classified,
+        "extracted": len(filtered),
+        "upserted": upserted,
+        "dead_letters": len(dead_letters),
+        "errors": provider_errors,
+        "timings": timings,
+    }
+    progress("done", **summary)
+    return summary
+
+STATUSES = ["Applied", "Rejected", "Interview", "Offer"]
+# Columns returned for each status, besides company_name and job_title
+STATUS_COLUMNS = {
+    "Applied": ["date_applied"],
+    "Rejected": ["date_applied", "date_rejected"],
+    "Interview": ["date_applied", "interview_date"],
+    "Offer": ["date_applied", "interview_date", "offer_date"],
+}
+
+def get_applications_page(limit: int = None, cursors: dict = None):
+    """
+    Fetch applications for every status in one indexed query.
+
+    limit caps the rows per status. cursors maps status -> the last job_id
+    already seen; when given, only those statuses are read, continuing after
+    that job_id. Returns (result_dict, next_cursors), where next_cursors has
+    an entry for each status with more rows, or is None when all are done.
+    """
+    statuses = [s for s in STATUSES if s in cursors] if cursors else STATUSES
+    result_dict: dict[str, list[dict]] = {status: [] for status in STATUSES}
+    if not statuses:
+        return result_dict, None
+
+    params = {}
+    conditions = []
+    for i, status in enumerate(statuses):
+        conditions.append(f"(application_status = :status_{i} AND job_id > :after_{i})")
+        params[f"status_{i}"] = status
+        params[f"after_{i}"] = (cursors or {}).get(status, "")
+    inner = f"""
+        SELECT job_id, company_name, job_title, application_status,
+               date_applied, date_rejected, interview_date, offer_date,
+               ROW_NUMBER() OVER (PARTITION BY application_status ORDER BY job_id) AS status_rank
+        FROM job_applications
+        WHERE {" OR ".join(conditions)}
+    """
+    if limit:
+        # Fetch one extra row per status to know whether another page exists
+        stmt = text(f"SELECT * FROM ({inner}) AS ranked WHERE status_rank <= :limit ORDER BY application_status, job_id")
+        params["limit"] = limit + 1
+    else:
+        stmt = text(f"{inner} ORDER BY application_status, job_id")
+
+    next_cursors = {}
+    with get_engine().connect() as conn:
+        for row in conn.execute(stmt, params).mappings():
+            status = row["application_status"]
+            records = result_dict[status]
+            if limit and len(records) == limit:
+                next_cursors[status] = records[-1]["job_id"]
+                continue
+            records.append(dict(row))
+
+    for status in STATUSES:
+        columns = ["company_name", "job_title"] + STATUS_COLUMNS[status]
+        result_dict[status] = [{column: record[column] for column in columns} for record in result_dict[status]]
+    return result_dict, (next_cursors or None)
 
 def get_applications_by_status() -> dict:
     """
     Returns a dict mapping each status to a list of records.
     Each record is a dict with only the fields relevant for that status.
     """
-    DATABASE_URL = os.getenv("DATABASE_URL")
-    engine = initialize_db(DATABASE_URL)
+    result_dict, _ = get_applications_page()
+    return result_dict
 
-    statuses = ["Applied", "Rejected", "Interview", "Offer"]
-    result_dict: dict[str, list[dict]] = {}
-
-    with engine.begin() as conn:
-        for status in tqdm(statuses):
-            if status == "Applied":
-                stmt = text("""
-                    SELECT company_name, job_title, date_applied
-                    FROM job_applications
-                    WHERE application_status = :status
-                """)
-            elif status == "Rejected":
-                stmt = text("""
-                    SELECT company_name, job_title, date_applied, date_rejected
-                    FROM job_applications
-                    WHERE application_status = :status
-                """)
-            elif status == "Interview":
-                stmt = text("""
-                    SELECT company_name, job_title, date_applied, interview_date
-                    FROM job_applications
-                    WHERE application_status = :status
-                """)
-            else:  # Offer
-                stmt = text("""
-                    SELECT company_name, job_title, date_applied, interview_date, offer_date
-                    FROM job_applications
-                    WHERE application_status = :status
-                """)
-
-            rows = conn.execute(stmt, {"status": status}).mappings().all()
-            # .mappings() gives each row as dict-like
-            result_dict[status] = [dict(r) for r in rows]
-
-    return result_dict
\ No newline at end of file
+def get_applications_version() -> int:
+    with get_engine().connect() as conn:
+        return get_data_version(conn)
@@ -0,0 +1,124 @@
+import os
+import re
+from urllib.parse import urlsplit
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:  # tiktoken missing or encoding files unavailable offline
+    _encoding = None
+
+# Upper bound on prompt tokens spent on a single email
+EMAIL_TOKEN_BUDGET = int(os.getenv("EMAIL_TOKEN_BUDGET", "600"))
+
+_BODY_PLACEHOLDER = '<Text body not available>'
+
+# Anything after one of these lines is quoted history from earlier messages
+_QUOTE_MARKERS = [re.compile(p, re.IGNORECASE | re.MULTILINE) for p in (
+    r"^On .{0,200}wrote:\s*$",
+    r"^-{2,}\s*Original Message\s*-{2,}",
+    r"^-{2,}\s*Forwarded message\s*-{2,}",
+    r"^From:\s.*\n(Sent|Date):\s",
+    r"^_{10,}\s*$",
+)]
+# Standard signature delimiter, plus common sign-offs
+_SIGNATURE_MARKERS = [re.compile(p, re.IGNORECASE | re.MULTILINE) for p in (
+    r"^--\s*$",
+    r"^(best|kind|warm)( regards)?,?\s*$",
+    r"^(regards|thanks|thank you|sincerely|cheers),?\s*$",
+    r"^sent from my (iphone|android|mobile)",
+)]
+_FOOTER_LINE = re.compile(
+    r"unsubscribe|privacy policy|terms of (use|service)|all rights reserved|©|\(c\) \d{4}|"
+    r"this (e-?mail|message) (was sent|is intended|may contain)|confidential|"
+    r"do not reply|manage (your )?(email )?preferences|view (this email )?in (your )?browser",
+    re.IGNORECASE,
+)
+_URL = re.compile(r"https?://[^\s<>\"')\]]+")
+
+
+def count_tokens(text: str) -> int:
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    # Rough estimate for English text when tiktoken isn't available
+    return (len(text) + 3) // 4
+
+
+def _truncate_to_tokens(text: str, max_tokens: int) -> str:
+    if count_tokens(text) <= max_tokens:
+        return text
+    if _encoding is not None:
+        return _encoding.decode(_encoding.encode(text, disallowed_special=())[:max_tokens]) + " …"
+    return text[:max_tokens * 4] + " …"
+
+
+def _shorten_url(match) -> str:
+    # Tracking links are long and meaningless to the model; the host is enough
+    host = urlsplit(match.group()).netloc
+    return f"<{host}>" if host else ""
+
+
+def clean_body(body: str) -> str:
+    """Strip quoted replies, signatures, legal footers and tracking URLs."""
+    body = body.replace("\r\n", "\n")
+    lines = [line for line in body.split("\n") if not line.lstrip().startswith(">")]
+    body = "\n".join(lines)
+
+    for pattern in _QUOTE_MARKERS:
+        match = pattern.search(body)
+        if match:
+            body = body[:match.start()]
+    # Only treat sign-offs as a signature when they appear late in the body
+    for pattern in _SIGNATURE_MARKERS:
+        match = pattern.search(body)
+        if match and match.start() > len(body) * 0.4:
+            body = body[:match.start()]
+
+    body = _URL.sub(_shorten_url, body)
+    lines = [line.strip() for line in body.split("\n")]
+    lines = [line for line in lines if line and not _FOOTER_LINE.search(line)]
+    return re.sub(r"[ \t]+", " ", "\n".join(lines)).strip()
+
+
+def compact_email(email, max_tokens: int = EMAIL_TOKEN_BUDGET) -> str:
+    """
+    Reduce an email to the text the classifier needs. Email dicts keep only
+    subject, sender, date, any thread context and a cleaned body (the snippet
+    is used only when no body was decoded); recipients, labels, flags and
+    message IDs are dropped.
+    """
+    if isinstance(email, dict):
+        body = email.get('body')
+        if not body or body == _BODY_PLACEHOLDER:
+            body = email.get('snippet') or ''
+        text = (
+            f"Subject: {email.get('subject', '')}\n"
+            f"From: {email.get('sender', '')}\n"
+            f"Date: {email.get('date', '')}\n"
+            + (f"{email['thread_context']}\n" if email.get('thread_context') else "")
+            + f"Body: {clean_body(body)}"
+        )
+    else:
+        text = clean_body(str(email))
+    return _truncate_to_tokens(text, max_tokens)
+
+
+class CompactionReport:
+    def __init__(self):
+        self.emails = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+
+    def add(self, original, compacted: str):
+        self.emails += 1
+        self.tokens_before += count_tokens(str(original))
+        self.tokens_after += count_tokens(compacted)
+
+    def as_dict(self) -> dict:
+        saved = self.tokens_before - self.tokens_after
+        return {
+            "emails": self.emails,
+            "tokens_before": self.tokens_before,
+            "tokens_after": self.tokens_after,
+            "saved_pct": round(100 * saved / self.tokens_before, 1) if self.tokens_before else 0.0,
+        }
@@ -0,0 +1,81 @@
+import re
+from datetime import date, datetime
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+from typing import Optional
+
+DATE_FIELDS = ("date_applied", "date_rejected", "interview_date", "offer_date")
+
+_NULL_STRINGS = {"none", "null", "n/a", "na", "unknown", "not present", "-"}
+_ORDINAL_SUFFIX = re.compile(r"(\d{1,2})(st|nd|rd|th)\b", re.IGNORECASE)
+# Free-form formats the LLM produces besides ISO 8601 and RFC 2822
+_FORMATS = (
+    "%B %d, %Y", "%b %d, %Y", "%B %d %Y", "%b %d %Y",
+    "%d %B %Y", "%d %b %Y", "%d %B, %Y", "%d %b, %Y",
+    "%A, %B %d, %Y", "%a, %b %d, %Y",
+    "%m/%d/%Y", "%Y/%m/%d", "%m-%d-%Y", "%Y.%m.%d",
+)
+
+
+@lru_cache(maxsize=4096)
+def _parse_date_string(value: str) -> Optional[date]:
+    value = value.strip()
+    if not value or value.lower() in _NULL_STRINGS:
+        return None
+    # ISO 8601: "2025-06-03", "2025-06-03T14:00:00Z", "2025-06-03 14:00:00+02:00"
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).date()
+    except ValueError:
+        pass
+    # RFC 2822, as in Gmail Date headers: "Tue, 3 Jun 2025 14:00:00 +0000"
+    if re.search(r"\d{1,2}:\d{2}", value):
+        try:
+            return parsedate_to_datetime(value).date()
+        except (TypeError, ValueError):
+            pass
+    cleaned = value
+    if not cleaned[:4].isdigit():
+        # Abbreviated months: "Jan. 5, 2025", "Sept. 3, 2025"
+        cleaned = re.sub(r"\bSept\b", "Sep", cleaned.replace(".", ""))
+    cleaned = " ".join(_ORDINAL_SUFFIX.sub(r"\1", cleaned).split())
+    for fmt in _FORMATS:
+        try:
+            return datetime.strptime(cleaned, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def parse_date(value) -> Optional[date]:
+    """
+    Return a date for an ISO 8601, RFC 2822 or written-out ("June 3, 2025")
+    value, or None if it can't be parsed. Results for strings are memoized.
+    """
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return _parse_date_string(str(value))
+
+
+def normalize_dates(items, fields=DATE_FIELDS):
+    """
+    Batch form of parse_date for a list of result dicts: each distinct value
+    across all items and fields is parsed once. Returns new dicts with the
+    given fields replaced by dates (or None).
+    """
+    parsed = {}
+    for item in items:
+        for field in fields:
+            value = item.get(field)
+            if isinstance(value, str) and value not in parsed:
+                parsed[value] = parse_date(value)
+    return [
+        {**item, **{
+            field: parsed[item.get(field)] if isinstance(item.get(field), str) else parse_date(item.get(field))
+            for field in fields
+        }}
+        for item in items
+    ]
@@ -0,0 +1,207 @@
+import os
+import threading
+from datetime import datetime
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine, make_url
+
+load_dotenv()
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Recycle connections before server-side idle timeouts drop them
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+# Arbitrary application-wide key for the PostgreSQL migration advisory lock
+MIGRATIONS_LOCK_KEY = 5_318_008_001
+
+# Ordered schema migrations: (version, statements). Append new versions only;
+# never edit one that has shipped.
+MIGRATIONS = [
+    (1, [
+        """
+        CREATE TABLE IF NOT EXISTS job_applications (
+            job_id TEXT PRIMARY KEY,
+            date_applied DATE,
+            company_name TEXT,
+            job_title TEXT,
+            application_status TEXT,
+            date_rejected DATE,
+            interview_date DATE,
+            offer_date DATE
+        )
+        """,
+    ]),
+    (2, [
+        # Per-user incremental sync cursors (Gmail historyId, Outlook delta link)
+        """
+        CREATE TABLE IF NOT EXISTS sync_state (
+            user_id TEXT NOT NULL,
+            provider TEXT NOT NULL,
+            cursor TEXT,
+            updated_at TIMESTAMP,
+            PRIMARY KEY (user_id, provider)
+        )
+        """,
+    ]),
+    (3, [
+        # The natural key must be unique for the bulk upsert's ON CONFLICT;
+        # collapse duplicates left by the old SELECT-then-INSERT path first.
+        # The surviving row takes every duplicate's latest date per column and
+        # the status with the latest date, so no status history is lost.
+        """
+        UPDATE job_applications SET
+            date_applied = (SELECT MAX(d.date_applied) FROM job_applications d
+                WHERE d.company_name = job_applications.company_name AND d.job_title = job_applications.job_title),
+            date_rejected = (SELECT MAX(d.date_rejected) FROM job_applications d
+                WHERE d.company_name = job_applications.company_name AND d.job_title = job_applications.job_title),
+            interview_date = (SELECT MAX(d.interview_date) FROM job_applications d
+                WHERE d.company_name = job_applications.company_name AND d.job_title = job_applications.job_title),
+            offer_date = (SELECT MAX(d.offer_date) FROM job_applications d
+                WHERE d.company_name = job_applications.company_name AND d.job_title = job_applications.job_title),
+            application_status = COALESCE((
+                SELECT d.application_status FROM job_applications d
+                WHERE d.company_name = job_applications.company_name AND d.job_title = job_applications.job_title
+                  AND d.application_status IN ('Applied', 'Rejected', 'Interview', 'Offer')
+                ORDER BY
+                    (CASE d.application_status WHEN 'Applied' THEN d.date_applied WHEN 'Rejected' THEN d.date_rejected
+                        WHEN 'Interview' THEN d.interview_date ELSE d.offer_date END) IS NULL,
+                    (CASE d.application_status WHEN 'Applied' THEN d.date_applied WHEN 'Rejected' THEN d.date_rejected
+                        WHEN 'Interview' THEN d.interview_date ELSE d.offer_date END) DESC
+                LIMIT 1
+            ), application_status)
+        WHERE job_id IN (
+            SELECT MIN(job_id) FROM job_applications
+            WHERE company_name IS NOT NULL AND job_title IS NOT NULL
+            GROUP BY company_name, job_title
+            HAVING COUNT(*) > 1
+        )
+        """,
+        """
+        DELETE FROM job_applications
+        WHERE company_name IS NOT NULL AND job_title IS NOT NULL
+          AND job_id NOT IN (
+            SELECT MIN(job_id) FROM job_applications
+            WHERE company_name IS NOT NULL AND job_title IS NOT NULL
+            GROUP BY company_name, job_title
+          )
+        """,
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_job_applications_company_title
+        ON job_applications (company_name, job_title)
+        """,
+    ]),
+    (4, [
+        # Serves the grouped, keyset-paginated applications_by_status query
+        """
+        CREATE INDEX IF NOT EXISTS ix_job_applications_status_job_id
+        ON job_applications (application_status, job_id)
+        """,
+        # Bumped by every classification run that writes rows; response
+        # caches and ETags key off it
+        """
+        CREATE TABLE IF NOT EXISTS data_version (
+            id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+        """,
+        "INSERT INTO data_version (id, version) VALUES (1, 0) ON CONFLICT (id) DO NOTHING",
+    ]),
+    (5, [
+        # Emails whose extraction failed, retried at the start of the next run
+        # since the sync cursor has already moved past them
+        """
+        CREATE TABLE IF NOT EXISTS dead_letters (
+            user_id TEXT NOT NULL,
+            provider TEXT NOT NULL,
+            message_id TEXT NOT NULL,
+            email TEXT NOT NULL,
+            error TEXT,
+            attempts INTEGER NOT NULL,
+            updated_at TIMESTAMP,
+            PRIMARY KEY (user_id, provider, message_id)
+        )
+        """,
+    ]),
+]
+
+
+def create_db_engine(database_url: str) -> Engine:
+    options = {"pool_pre_ping": True}
+    # SQLite's pools don't take size/overflow settings
+    if make_url(database_url).get_backend_name() != "sqlite":
+        options.update(
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+        )
+    return create_engine(database_url, **options)
+
+
+def run_migrations(engine: Engine) -> int:
+    """Apply every migration newer than the recorded schema version."""
+    with engine.begin() as conn:
+        # Workers starting together would otherwise race on the same DDL, which
+        # PostgreSQL can reject even with IF NOT EXISTS. The lock is released
+        # at commit, after which the others see the new version and skip.
+        # SQLite serializes writers on its own.
+        if engine.dialect.name == "postgresql":
+            conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATIONS_LOCK_KEY})
+        conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            applied_at TIMESTAMP
+        )
+        """))
+        current = conn.execute(text("SELECT MAX(version) FROM schema_migrations")).scalar() or 0
+
+        for version, statements in MIGRATIONS:
+            if version <= current:
+                continue
+            for statement in statements:
+                conn.execute(text(statement))
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, applied_at) VALUES (:version, :applied_at)"),
+                {"version": version, "applied_at": datetime.utcnow()},
+            )
+            print(f"Applied schema migration {version}")
+            current = version
+    return current
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def init_engine(database_url: str = None) -> Engine:
+    """Create the process-wide engine and bring the schema up to date (once)."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            engine = create_db_engine(database_url or os.getenv("DATABASE_URL"))
+            run_migrations(engine)
+            _engine = engine
+    return _engine
+
+
+def get_engine() -> Engine:
+    return _engine if _engine is not None else init_engine()
+
+
+def get_data_version(conn) -> int:
+    return conn.execute(text("SELECT version FROM data_version WHERE id = 1")).scalar() or 0
+
+
+def bump_data_version(conn):
+    conn.execute(text("UPDATE data_version SET version = version + 1 WHERE id = 1"))
+
+
+def dispose_engine():
+    global _engine
+    with _engine_lock:
+        engine, _engine = _engine, None
+    if engine is not None:
+        engine.dispose()
@@ -0,0 +1,426 @@
+import asyncio
+import json
+import os
+import re
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional, Dict, Any, List, Literal
+
+import httpx
+import openai
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_openai import ChatOpenAI
+from pydantic import BaseModel, ValidationError
+from tqdm import tqdm
+
+# Number of LLM requests allowed in flight at once
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+
+_RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+
+
+def _parse_duration(value) -> Optional[float]:
+    """Parse OpenAI reset headers such as '1s', '6m0s', '20ms' or '0.5'."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r'(\d+(?:\.\d+)?)(ms|h|m|s)', value)
+    if not parts:
+        return None
+    scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(amount) * scale[unit] for amount, unit in parts)
+
+
+def retry_delay_from_headers(headers) -> Optional[float]:
+    """How long the API asked us to wait, from a response's headers."""
+    if not headers:
+        return None
+    if headers.get("retry-after-ms"):
+        return _parse_duration(headers["retry-after-ms"]) / 1000
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        seconds = _parse_duration(retry_after)
+        if seconds is not None:
+            return seconds
+        try:
+            return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    return _parse_duration(headers.get("x-ratelimit-reset-requests"))
+
+
+class RateLimitGate:
+    """
+    Shared pause point for all workers: once any request is throttled, every
+    worker waits until the advertised reset time instead of piling on more
+    429s.
+    """
+
+    def __init__(self):
+        self._resume_at = 0.0
+
+    def pause(self, seconds: float):
+        self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+    async def wait(self):
+        delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def observe(self, headers):
+        # Back off before hitting the limit when the budget is exhausted
+        if not headers:
+            return
+        for remaining, reset in (
+            ("x-ratelimit-remaining-requests", "x-ratelimit-reset-requests"),
+            ("x-ratelimit-remaining-tokens", "x-ratelimit-reset-tokens"),
+        ):
+            if headers.get(remaining) == "0":
+                self.pause(_parse_duration(headers.get(reset)) or 1.0)
+
+
+async def _invoke_with_retries(llm, messages, parse, gate: RateLimitGate, semaphore: asyncio.Semaphore, max_retries: int):
+    for attempt in range(max_retries + 1):
+        await gate.wait()
+        try:
+            async with semaphore:
+                response = await llm.ainvoke(input=messages)
+            gate.observe(response.response_metadata.get("headers"))
+            return parse(response.content)
+        except _RETRYABLE_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            response = getattr(e, "response", None)
+            delay = retry_delay_from_headers(response.headers if response is not None else None)
+            if delay is None:
+                delay = min(30.0, 2 ** attempt) + random.random()
+            if isinstance(e, openai.RateLimitError):
+                gate.pause(delay)
+            await asyncio.sleep(delay)
+        except ValueError:
+            # Unparseable reply; the model is sampled, so ask again
+            if attempt == max_retries:
+                raise
+
+
+async def classify_concurrently(llm, message_lists, parse, max_concurrency: int = LLM_MAX_CONCURRENCY, max_retries: int = LLM_MAX_RETRIES, on_result=None, on_error=None):
+    """
+    Send each prompt (a list of chat messages) to the LLM with at most
+    max_concurrency requests in flight, retrying items individually.
+    Returns the parsed results in input order; on_result(index, parsed), if
+    given, is called as soon as each item finishes. If on_error is given, an
+    item that still fails after its retries is reported through
+    on_error(index, exception) and left as None instead of failing the run.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    gate = RateLimitGate()
+    progress = tqdm(total=len(message_lists))
+
+    async def _one(index, messages):
+        try:
+            parsed = await _invoke_with_retries(llm, messages, parse, gate, semaphore, max_retries)
+        except Exception as e:
+            if on_error is None:
+                raise
+            on_error(index, e)
+            return None
+        finally:
+            progress.update(1)
+        if on_result is not None:
+            on_result(index, parsed)
+        return parsed
+
+    try:
+        return await asyncio.gather(*(_one(index, messages) for index, messages in enumerate(message_lists)))
+    finally:
+        progress.close()
+
+
+def extract_application_info(raw_response: str) -> Optional[Dict[str, Any]]:
+    """
+    Given the LLM's raw response, return a Python dict if it contains JSON,
+    or None if the response is exactly "None" (case-insensitive).
+    """
+    text = raw_response.strip()
+    # strip markdown code fences
+    text = re.sub(r'^```(?:json)?\s*', '', text)
+    text = re.sub(r'\s*```$', '', text)
+    
+    if text.lower() == 'none':
+        return None
+    
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        # fallback: grab the first {...} block
+        m = re.search(r'\{.*\}', text, re.DOTALL)
+        if m:
+            try:
+                return json.loads(m.group())
+            except json.JSONDecodeError:
+                pass
+        raise ValueError(f"Could not parse JSON from response: {raw_response!r}")
+
+# Status -> the date column recording when that email arrived
+STATUS_DATE_FIELDS = {
+    "Applied": "date_applied",
+    "Rejected": "date_rejected",
+    "Interview": "interview_date",
+    "Offer": "offer_date",
+}
+
+class JobApplicationInfo(BaseModel):
+    date_applied: Optional[str]
+    company_name: Optional[str]
+    job_title: Optional[str]
+    application_status: Literal["Applied", "Interview", "Offer", "Rejected"]
+    date_rejected: Optional[str]
+    interview_date: Optional[str]
+    offer_date: Optional[str]
+
+class EmailExtraction(BaseModel):
+    is_job_application: bool
+    application: Optional[JobApplicationInfo]
+
+class BatchEmailExtraction(EmailExtraction):
+    id: str
+
+class BatchExtraction(BaseModel):
+    results: List[BatchEmailExtraction]
+
+def _to_application_dict(extraction: EmailExtraction) -> Optional[Dict[str, Any]]:
+    if not extraction.is_job_application or extraction.application is None:
+        return None
+    return extraction.application.model_dump()
+
+def parse_extraction(raw_response: str) -> Optional[Dict[str, Any]]:
+    """
+    Validate a structured-output reply against EmailExtraction and return
+    the same value extract_application_info would: the application dict, or
+    None for non-job emails. Replies that aren't schema-shaped go through
+    the lenient extract_application_info parser and are then validated.
+    Raises ValueError (pydantic's ValidationError included) if neither works.
+    """
+    try:
+        return _to_application_dict(EmailExtraction.model_validate_json(raw_response))
+    except ValidationError:
+        parsed = extract_application_info(raw_response)
+        return None if parsed is None else JobApplicationInfo.model_validate(parsed).model_dump()
+
+def extract_batch_info(raw_response: str) -> Dict[str, Optional[Dict[str, Any]]]:
+    """
+    Parse a batch reply shaped like BatchExtraction (a bare JSON array of
+    its items is accepted too). Returns {id: parsed} for the items that
+    validate; missing or malformed items are left out so the caller can
+    retry them individually. Raises ValueError if no results can be found.
+    """
+    text = raw_response.strip()
+    text = re.sub(r'^```(?:json)?\s*', '', text)
+    text = re.sub(r'\s*```$', '', text)
+    try:
+        items = json.loads(text)
+    except json.JSONDecodeError:
+        m = re.search(r'\[.*\]', text, re.DOTALL)
+        try:
+            items = json.loads(m.group()) if m else None
+        except json.JSONDecodeError:
+            items = None
+    if isinstance(items, dict):
+        items = items.get('results')
+    if not isinstance(items, list):
+        raise ValueError(f"Could not parse batch results from response: {raw_response!r}")
+
+    parsed = {}
+    for item in items:
+        # Validated one by one so a single bad item doesn't sink the batch
+        try:
+            extraction = BatchEmailExtraction.model_validate(item)
+        except ValidationError:
+            continue
+        parsed[extraction.id] = _to_application_dict(extraction)
+    return parsed
+
+# Bump PROMPT_VERSION whenever the prompt or parsing changes, so cached
+# extraction results from the old prompt are no longer used.
+PROMPT_VERSION = "3"
+LLM_MODEL = "gpt-4o-mini"
+# Emails packed into one request in batch mode; 1 disables batching
+LLM_BATCH_SIZE = int(os.getenv("LLM_BATCH_SIZE", "5"))
+
+SYSTEM_MESSAGE_TEMPLATE = """
+    You are an assistant that analyzes whether a given email is a job application email.  
+    - If it is a job application email, set "is_job_application" to true and put the following in "application":  
+      1. "date_applied" (null if the email is not for Applied)
+      2. “company_name”  
+      3. “job_title”  
+      4. “application_status” (Applied, Interview, Offer, Rejected)  
+      5. "date_rejected" (null if not present)(null if the email is not for Rejected)(Date of receiving the rejection email)
+      6. "interview_date" (null if not present)(Date of receiving the interview email)(null if the email is not for an Interview)
+      7. "offer_date" (null if not present)(Date of receiving the offer email)(null if the email is not for an Offer)
+
+    - If it is NOT a job application email, set "is_job_application" to false and "application" to null.
+    """
+
+HUMAN_MESSAGE_TEMPLATE = """
+    Analyze the following email:
+
+    {email_body}
+    """
+
+BATCH_SYSTEM_MESSAGE_TEMPLATE = SYSTEM_MESSAGE_TEMPLATE + """
+    You will be given several emails, each introduced by a line "### Email <id>".
+    Analyze every email independently. Put one element per email, in the same
+    order, in "results", each with the email's "id" plus "is_job_application"
+    and "application" as described above.
+    """
+
+BATCH_HUMAN_MESSAGE_TEMPLATE = """
+    Analyze the following emails:
+
+    {email_bodies}
+    """
+
+def batch_email_id(index: int) -> str:
+    return f"E{index + 1}"
+
+
+# Keep-alive pool shared by every request the classifier makes
+LLM_HTTP_LIMITS = httpx.Limits(max_connections=LLM_MAX_CONCURRENCY * 2, max_keepalive_connections=LLM_MAX_CONCURRENCY, keepalive_expiry=120)
+LLM_HTTP_TIMEOUT = httpx.Timeout(60.0, connect=10.0)
+# Longest a caller blocks on one run() call, so a caller stranded by a
+# shutdown gets an error instead of waiting forever
+LLM_RUN_TIMEOUT = float(os.getenv("LLM_RUN_TIMEOUT", "900"))
+
+
+class EmailClassifier:
+    """
+    Process-wide owner of the prompt templates, the ChatOpenAI client and its
+    keep-alive HTTP pools, so /classify requests reuse warm connections
+    instead of rebuilding them every call.
+
+    All async LLM calls run on one background event loop owned by the
+    classifier: an httpx.AsyncClient is bound to the loop it first ran on,
+    so it can't be shared across asyncio.run() calls.
+    """
+
+    def __init__(self, model: str = LLM_MODEL, temperature: float = 0.2):
+        self.template = ChatPromptTemplate([
+            ("system", SYSTEM_MESSAGE_TEMPLATE),
+            ("human", HUMAN_MESSAGE_TEMPLATE)
+        ])
+        self.batch_template = ChatPromptTemplate([
+            ("system", BATCH_SYSTEM_MESSAGE_TEMPLATE),
+            ("human", BATCH_HUMAN_MESSAGE_TEMPLATE)
+        ])
+        self.http_client = httpx.Client(limits=LLM_HTTP_LIMITS, timeout=LLM_HTTP_TIMEOUT)
+        self.http_async_client = httpx.AsyncClient(limits=LLM_HTTP_LIMITS, timeout=LLM_HTTP_TIMEOUT)
+        self.llm = ChatOpenAI(
+            model_name=model,
+            temperature=temperature,
+            api_key=os.getenv("OPENAI_API_KEY"),
+            # Retries and rate-limit backoff are handled per item by classify_concurrently
+            max_retries=0,
+            include_response_headers=True,
+            http_client=self.http_client,
+            http_async_client=self.http_async_client,
+        )
+        # Structured output: replies are JSON constrained to the schema
+        self.single_llm = self.llm.bind(response_format=EmailExtraction)
+        self.batch_llm = self.llm.bind(response_format=BatchExtraction)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="llm-classifier", daemon=True)
+        self._thread.start()
+
+    def single_messages(self, email_text: str):
+        return self.template.format_prompt(email_body=email_text).to_messages()
+
+    def batch_messages(self, emails):
+        """emails: list of (email_id, email_text) pairs."""
+        return self.batch_template.format_prompt(email_bodies="\n\n".join(
+            f"### Email {email_id}\n{email_text}" for email_id, email_text in emails
+        )).to_messages()
+
+    def run(self, coro, timeout: float = LLM_RUN_TIMEOUT):
+        """
+        Run a coroutine on the classifier's loop and block for its result.
+        Raises TimeoutError after timeout seconds, and CancelledError if the
+        classifier shuts down first.
+        """
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            future.cancel()
+            raise
+
+    def warm_up(self):
+        """Open a connection to the API ahead of the first classification."""
+        async def _connect():
+            await self.http_async_client.get(
+                f"{self.llm.openai_api_base or 'https://api.openai.com/v1'}/models",
+                headers={"Authorization": f"Bearer {os.getenv('OPENAI_API_KEY', '')}"},
+            )
+        try:
+            self.run(_connect())
+        except Exception as e:
+            print(f"LLM warm-up failed: {e}")
+
+    def shutdown(self):
+        async def _close():
+            # Cancelling in-flight calls fails their run() callers right away
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.http_async_client.aclose()
+
+        try:
+            self.run(_close(), timeout=10)
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+            self._loop.close()
+            self.http_client.close()
+
+
+_classifier = None
+_classifier_lock = threading.Lock()
+
+
+def get_classifier() -> EmailClassifier:
+    global _classifier
+    with _classifier_lock:
+        if _classifier is None:
+            _classifier = EmailClassifier()
+    return _classifier
+
+
+def warm_up_classifier():
+    # A bad configuration (e.g. no OPENAI_API_KEY) must not stop the API from
+    # starting; the first classification raises it again
+    try:
+        classifier = get_classifier()
+    except Exception as e:
+        print(f"LLM warm-up failed: {e}")
+        return
+    classifier.warm_up()
+
+
+def shutdown_classifier():
+    global _classifier
+    with _classifier_lock:
+        classifier, _classifier = _classifier, None
+    if classifier is not None:
+        classifier.shutdown()
@@ -4,7 +4,9 @@ from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime. base import MIMEBase
 from email import encoders
+from googleapiclient.errors import HttpError
 from gmail_auth import create_service
+from ttl_cache import TTLCache
 def init_gmail_service(client_file, api_name='gmail', api_version='v1', scopes=['https://mail.google.com/']):
     return create_service(client_file, api_name, api_version, scopes)
 # All the emails sent by gmail are in a data structure called payload
@@ -27,14 +29,44 @@ def _extract_body (payload):
     elif 'body' in payload and 'data' in payload [ 'body' ]:
         body = base64.urlsafe_b64decode (payload [ 'body'] ['data']).decode('utf-8')
     return body
-def get_email_messages(service, user_id='me', label_ids=None, folder_name='INBOX', max_results=5, query="newer_than:1d"):
+# System labels have fixed IDs equal to their upper-case names, so they never
+# need a labels().list round trip.
+SYSTEM_LABEL_IDS = {
+    name.lower(): name
+    for name in ('INBOX', 'SENT', 'DRAFT', 'SPAM', 'TRASH', 'STARRED', 'UNREAD', 'IMPORTANT')
+}
+
+# (cache_key, folder name) -> label ID for user-created labels
+_label_id_cache = TTLCache(maxsize=4096, ttl=15 * 60)
+
+def get_label_id(service, folder_name, user_id='me', cache_key=None):
+    """
+    Resolve a folder/label name to its Gmail label ID. cache_key identifies
+    the mailbox owner; without it user labels are looked up every time.
+    """
+    system_id = SYSTEM_LABEL_IDS.get(folder_name.lower())
+    if system_id:
+        return system_id
+
+    key = (cache_key, folder_name.lower())
+    if cache_key is not None:
+        label_id = _label_id_cache.get(key)
+        if label_id:
+            return label_id
+
+    label_results = service.users().labels().list(userId=user_id).execute()
+    labels = label_results.get('labels', [])
+    label_id = next((label['id'] for label in labels if label['name'].lower() == folder_name.lower()), None)
+    if label_id and cache_key is not None:
+        _label_id_cache.set(key, label_id)
+    return label_id
+
+def get_email_messages(service, user_id='me', label_ids=None, folder_name='INBOX', max_results=5, query="newer_than:1d", cache_key=None):
     messages = []
     next_page_token = None
     
     if folder_name:
-        label_results = service.users().labels().list(userId=user_id).execute()
-        labels = label_results.get('labels', [])
-        folder_label_id = next((label['id'] for label in labels if label['name'].lower() == folder_name.lower()), None)
+        folder_label_id = get_label_id(service, folder_name, user_id=user_id, cache_key=cache_key)
         if folder_label_id:
             if label_ids:
                 label_ids.append(folder_label_id)
@@ -60,8 +92,54 @@ def get_email_messages(service, user_id='me', label_ids=None, folder_name='INBOX
     return messages[:max_results] if max_results else messages
     
 
-def get_email_message_details(service, msg_id):
-    message = service.users().messages().get(userId='me', id=msg_id, format='full').execute()
+class HistoryExpiredError(Exception):
+    """The stored historyId is too old (or invalid) for users.history.list."""
+
+def get_current_history_id(service, user_id='me'):
+    profile = service.users().getProfile(userId=user_id).execute()
+    return profile['historyId']
+
+def get_message_ids_since(service, start_history_id, user_id='me', label_id='INBOX'):
+    """
+    Return (message_ids, latest_history_id) for messages added to label_id
+    since start_history_id, using the Gmail history API.
+
+    Raises HistoryExpiredError when Gmail no longer has history that far
+    back, in which case the caller should fall back to a full scan.
+    """
+    message_ids = []
+    seen = set()
+    latest_history_id = start_history_id
+    next_page_token = None
+
+    while True:
+        try:
+            result = service.users().history().list(
+                userId=user_id,
+                startHistoryId=start_history_id,
+                historyTypes=['messageAdded'],
+                labelId=label_id,
+                pageToken=next_page_token
+            ).execute()
+        except HttpError as e:
+            if e.resp.status == 404:
+                raise HistoryExpiredError(f"historyId {start_history_id} is no longer available") from e
+            raise
+
+        for record in result.get('history', []):
+            for added in record.get('messagesAdded', []):
+                msg_id = added['message']['id']
+                if msg_id not in seen:
+                    seen.add(msg_id)
+                    message_ids.append(msg_id)
+        latest_history_id = result.get('historyId', latest_history_id)
+        next_page_token = result.get('nextPageToken')
+        if not next_page_token:
+            break
+
+    return message_ids, latest_history_id
+
+def _parse_message_details(message):
     payload = message['payload']
     headers = payload.get('headers', [])
     subject = next((header ['value'] for header in headers if header ['name'].lower() == 'subject'), None)
@@ -77,6 +155,8 @@ def get_email_message_details(service, msg_id):
     label = ', '.join(message.get('labelIds',[]))
     body = _extract_body(payload)
     return {
+        'id': message.get('id'),
+        'thread_id': message.get('threadId'),
         'subject':subject,
         'sender':sender,
         'recipients': recipients,
@@ -86,4 +166,60 @@ def get_email_message_details(service, msg_id):
         'date':date,
         'star':star,
         'label':label,
-    }
\ No newline at end of file
+    }
+
+# Headers requested for format='metadata' fetches; enough for a relevance
+# check without downloading and decoding the message body.
+METADATA_HEADERS = ['Subject', 'From', 'To', 'Date']
+
+def _get_message_request(service, msg_id, format='full'):
+    if format == 'metadata':
+        return service.users().messages().get(userId='me', id=msg_id, format='metadata', metadataHeaders=METADATA_HEADERS)
+    return service.users().messages().get(userId='me', id=msg_id, format=format)
+
+def get_email_message_details(service, msg_id, format='full'):
+    message = _get_message_request(service, msg_id, format).execute()
+    return _parse_message_details(message)
+
+# Gmail accepts up to 100 calls per batch, but recommends staying at or
+# below 50 to avoid rate limiting on the batch endpoint.
+GMAIL_BATCH_SIZE = 50
+
+def get_email_message_details_batch(service, msg_ids, batch_size=GMAIL_BATCH_SIZE, format='full'):
+    """
+    Fetch many messages through Gmail batch requests instead of one HTTP
+    round trip per message.
+
+    Returns a list aligned with msg_ids: each entry is the same dict that
+    get_email_message_details returns, or None if that message could not be
+    fetched. Messages that fail inside a batch are retried once on their own.
+    With format='metadata' only the METADATA_HEADERS and snippet are
+    downloaded, and 'body' is left as the placeholder text.
+    """
+    msg_ids = list(msg_ids)
+    results = [None] * len(msg_ids)
+    failed = []
+
+    def _callback(request_id, response, exception):
+        index = int(request_id)
+        if exception is not None:
+            failed.append(index)
+            return
+        try:
+            results[index] = _parse_message_details(response)
+        except Exception as e:
+            print(f"Failed to parse Gmail message {msg_ids[index]}: {e}")
+
+    for start in range(0, len(msg_ids), batch_size):
+        batch = service.new_batch_http_request(callback=_callback)
+        for index in range(start, min(start + batch_size, len(msg_ids))):
+            batch.add(_get_message_request(service, msg_ids[index], format), request_id=str(index))
+        batch.execute()
+
+    for index in sorted(failed):
+        try:
+            results[index] = get_email_message_details(service, msg_ids[index], format)
+        except Exception as e:
+            print(f"Failed to fetch Gmail message {msg_ids[index]}: {e}")
+
+    return results
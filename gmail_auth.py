@@ -1,11 +1,20 @@
 import os
+import json
+import threading
+import httpx
 from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build, build_from_document
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
 from datetime import datetime
 
+DISCOVERY_URL = 'https://{api}.googleapis.com/$discovery/rest?version={apiVersion}'
+
+# Parsed discovery documents, fetched once per process and shared by every
+# service built afterwards.
+_discovery_documents: dict = {}
+_discovery_lock = threading.Lock()
+
 def create_service(client_secret_file, api_name, api_version, scopes, prefix=''):
     CLIENT_SECRET_FILE = client_secret_file
     API_SERVICE_NAME = api_name
@@ -49,9 +58,31 @@ def convert_to_RFC_datetime(year=1900, month=1, day=1, hour=0, minute=0):
     dt = datetime.datetime(year, month, day, hour, minute, 0).isoformat() + 'Z'
     return dt
 
+def get_discovery_document(api_name="gmail", api_version="v1") -> dict:
+    key = (api_name, api_version)
+    document = _discovery_documents.get(key)
+    if document is None:
+        with _discovery_lock:
+            document = _discovery_documents.get(key)
+            if document is None:
+                url = DISCOVERY_URL.format(api=api_name, apiVersion=api_version)
+                response = httpx.get(url, timeout=30)
+                response.raise_for_status()
+                document = json.loads(response.text)
+                _discovery_documents[key] = document
+    return document
+
 def build_user_gmail_service(access_token: str, api_name="gmail", api_version="v1"):
+    """
+    Build a Gmail service for a user's access token from the cached discovery
+    document, so only the first call in a process touches the network.
+
+    Services are deliberately not shared between calls: they wrap an httplib2
+    connection that is not thread-safe, and building one from a cached
+    document is cheap.
+    """
     if not access_token:
         raise ValueError("Missing access token for Gmail service.")
     creds = Credentials(token=access_token)
-    service = build(api_name, api_version, credentials=creds, static_discovery=False)
+    service = build_from_document(get_discovery_document(api_name, api_version), credentials=creds)
     return service
\ No newline at end of file
@@ -0,0 +1,351 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Optional
+
+from ttl_cache import TTLCache
+
+CLASSIFY_JOBS_DB_PATH = os.getenv("CLASSIFY_JOBS_DB_PATH", "classify_jobs.sqlite3")
+CLASSIFY_WORKERS = int(os.getenv("CLASSIFY_WORKERS", "2"))
+# A repeat /classify within this many seconds of a successful run returns
+# that run instead of syncing again; 0 disables the cooldown
+CLASSIFY_COOLDOWN_SECONDS = float(os.getenv("CLASSIFY_COOLDOWN_SECONDS", "60"))
+# Per-email event logs are kept in memory only, for streaming a job live
+CLASSIFY_EVENT_LOGS_MAX = int(os.getenv("CLASSIFY_EVENT_LOGS_MAX", "64"))
+CLASSIFY_EVENT_LOG_TTL = float(os.getenv("CLASSIFY_EVENT_LOG_TTL", "900"))
+# Each process refreshes its unfinished jobs' heartbeat this often; a job whose
+# heartbeat is older than CLASSIFY_JOB_STALE_SECONDS lost its process
+CLASSIFY_HEARTBEAT_SECONDS = float(os.getenv("CLASSIFY_HEARTBEAT_SECONDS", "10"))
+CLASSIFY_JOB_STALE_SECONDS = float(os.getenv("CLASSIFY_JOB_STALE_SECONDS", "60"))
+# Several worker processes write the store; wait for the lock, don't fail
+CLASSIFY_JOBS_BUSY_TIMEOUT = float(os.getenv("CLASSIFY_JOBS_BUSY_TIMEOUT", "30"))
+# How long shutdown waits for running jobs before the classifier and database
+# they use are torn down
+CLASSIFY_SHUTDOWN_TIMEOUT = float(os.getenv("CLASSIFY_SHUTDOWN_TIMEOUT", "30"))
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+INTERRUPTED = "interrupted"
+FINISHED_STATES = (SUCCEEDED, FAILED, INTERRUPTED)
+
+INTERRUPTED_ERROR = "Server restarted before the job finished."
+
+
+def process_owner() -> str:
+    """This process's owner tag for the jobs it runs: host:pid."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _owner_alive(owner: str) -> bool:
+    """False only when owner is a process on this host that has exited."""
+    host, _, pid = (owner or "").rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobStore:
+    """SQLite-backed record of classification jobs that survives restarts."""
+
+    def __init__(self, path: str = CLASSIFY_JOBS_DB_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=CLASSIFY_JOBS_BUSY_TIMEOUT)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute(f"PRAGMA busy_timeout = {int(CLASSIFY_JOBS_BUSY_TIMEOUT * 1000)}")
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS classify_jobs (
+                job_id TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                provider TEXT NOT NULL,
+                state TEXT NOT NULL,
+                stage TEXT,
+                progress TEXT,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                owner TEXT,
+                heartbeat_at REAL
+            )
+        """)
+        # Stores created before jobs had owners
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(classify_jobs)")}
+        for column, kind in (("owner", "TEXT"), ("heartbeat_at", "REAL")):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE classify_jobs ADD COLUMN {column} {kind}")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_classify_jobs_user ON classify_jobs (user_id, created_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_classify_jobs_user_provider ON classify_jobs (user_id, provider, updated_at)")
+        self._conn.commit()
+
+    def claim(self, user_id: str, provider: str, owner: str, cooldown: float = 0,
+              stale_after: float = CLASSIFY_JOB_STALE_SECONDS) -> tuple[str, bool]:
+        """
+        Return (job_id, created); a new job is owned by owner. An existing
+        job is returned instead when the same user and provider already have
+        one queued or running with a live heartbeat, or one that succeeded
+        less than cooldown seconds ago.
+
+        The check and insert share one write transaction, so concurrent
+        callers, in this process or another, can't both create a job.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    """
+                    SELECT job_id FROM classify_jobs
+                    WHERE user_id = ? AND provider = ?
+                      AND ((state IN (?, ?) AND COALESCE(heartbeat_at, updated_at) >= ?)
+                           OR (state = ? AND updated_at >= ?))
+                    ORDER BY updated_at DESC LIMIT 1
+                    """,
+                    (user_id, provider, QUEUED, RUNNING, now - stale_after, SUCCEEDED, now - cooldown),
+                ).fetchone()
+                if row is not None:
+                    self._conn.commit()
+                    return row["job_id"], False
+                job_id = uuid.uuid4().hex
+                self._conn.execute(
+                    "INSERT INTO classify_jobs (job_id, user_id, provider, state, progress, created_at, updated_at, owner, heartbeat_at) VALUES (?, ?, ?, ?, '{}', ?, ?, ?, ?)",
+                    (job_id, user_id, provider, QUEUED, now, now, owner, now),
+                )
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+        return job_id, True
+
+    def update(self, job_id: str, **fields):
+        for key in ("progress", "result"):
+            if key in fields:
+                fields[key] = json.dumps(fields[key], default=str)
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE classify_jobs SET {assignments} WHERE job_id = ?", (*fields.values(), job_id))
+            self._conn.commit()
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM classify_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["progress"] = json.loads(job["progress"] or "{}")
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def heartbeat(self, owner: str):
+        """Mark owner's unfinished jobs as still alive."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE classify_jobs SET heartbeat_at = ? WHERE owner = ? AND state IN (?, ?)",
+                (time.time(), owner, QUEUED, RUNNING),
+            )
+            self._conn.commit()
+
+    def reap(self, stale_after: float = CLASSIFY_JOB_STALE_SECONDS) -> int:
+        """
+        Mark unfinished jobs whose process is gone as interrupted: the owner
+        is a process on this host that has exited, or the heartbeat is older
+        than stale_after. Jobs of live sibling workers are left alone.
+        """
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT job_id, owner, COALESCE(heartbeat_at, updated_at) AS seen_at FROM classify_jobs WHERE state IN (?, ?)",
+                (QUEUED, RUNNING),
+            ).fetchall()
+            orphans = [(row["job_id"],) for row in rows
+                       if row["seen_at"] < now - stale_after or not _owner_alive(row["owner"])]
+            if orphans:
+                self._conn.executemany(
+                    "UPDATE classify_jobs SET state = ?, error = ?, updated_at = ? WHERE job_id = ? AND state IN (?, ?)",
+                    [(INTERRUPTED, INTERRUPTED_ERROR, now, job_id, QUEUED, RUNNING) for (job_id,) in orphans],
+                )
+                self._conn.commit()
+        return len(orphans)
+
+    def interrupt_queued(self, owner: str) -> int:
+        """Flag owner's jobs that never started as interrupted, on shutdown."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE classify_jobs SET state = ?, error = ?, updated_at = ? WHERE owner = ? AND state = ?",
+                (INTERRUPTED, INTERRUPTED_ERROR, time.time(), owner, QUEUED),
+            )
+            self._conn.commit()
+        return cursor.rowcount
+
+
+# Per-email events that count as a verdict, for throughput stats
+VERDICT_EVENTS = ("skipped", "template", "classified", "failed")
+
+
+class JobEventLog:
+    """Append-only log of one job's events, readable from any thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events: list[dict] = []
+        self._counts: dict[str, int] = {}
+        self.started_at = time.time()
+
+    def append(self, event: str, data: dict):
+        with self._lock:
+            self._events.append({"id": len(self._events) + 1, "event": event, "data": data})
+            self._counts[event] = self._counts.get(event, 0) + 1
+
+    def since(self, last_id: int = 0) -> list[dict]:
+        """Events after last_id; IDs start at 1."""
+        with self._lock:
+            return self._events[last_id:]
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+        elapsed = time.time() - self.started_at
+        verdicts = sum(counts.get(event, 0) for event in VERDICT_EVENTS)
+        return {
+            "elapsed_seconds": round(elapsed, 2),
+            "counts": counts,
+            "emails_per_second": round(verdicts / elapsed, 2) if elapsed > 0 else 0.0,
+        }
+
+
+class JobQueue:
+    """Runs classification jobs on a bounded worker pool, off the event loop."""
+
+    def __init__(self, store: JobStore = None, workers: int = CLASSIFY_WORKERS):
+        self.store = store or JobStore()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="classify")
+        self._event_logs = TTLCache(maxsize=CLASSIFY_EVENT_LOGS_MAX, ttl=CLASSIFY_EVENT_LOG_TTL)
+        self.owner = process_owner()
+        self._futures = set()
+        self._futures_lock = threading.Lock()
+        self._reap()
+        # Keeps this process's jobs alive in the shared store and reaps the
+        # jobs of processes that died
+        self._stop = threading.Event()
+        self._heartbeat = threading.Thread(target=self._heartbeat_loop, name="classify-heartbeat", daemon=True)
+        self._heartbeat.start()
+
+    def _reap(self):
+        interrupted = self.store.reap()
+        if interrupted:
+            print(f"Marked {interrupted} orphaned classification jobs as interrupted")
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(CLASSIFY_HEARTBEAT_SECONDS):
+            try:
+                self.store.heartbeat(self.owner)
+                self._reap()
+            except sqlite3.Error as e:
+                print(f"Classification job heartbeat failed: {e}")
+
+    def submit(self, user_id: str, provider: str, run, cooldown: float = CLASSIFY_COOLDOWN_SECONDS) -> tuple[str, bool]:
+        """
+        Queue run(progress, emit) and return (job_id, coalesced). run
+        receives a progress(stage, **counts) callback, recorded in the job
+        store, and an emit(event, **data) callback, recorded in the job's
+        event log. Its return value is stored as the job's result.
+
+        Requests are coalesced per (user_id, provider): while a job is
+        queued or running, or within cooldown seconds of one succeeding,
+        that job is returned and run is not queued (coalesced is True).
+        """
+        job_id, created = self.store.claim(user_id, provider, self.owner, cooldown)
+        if not created:
+            return job_id, True
+        self._event_logs.set(job_id, JobEventLog())
+        future = self._pool.submit(self._run, job_id, run)
+        with self._futures_lock:
+            self._futures.add(future)
+        future.add_done_callback(self._forget)
+        return job_id, False
+
+    def _forget(self, future):
+        with self._futures_lock:
+            self._futures.discard(future)
+
+    def _run(self, job_id: str, run):
+        self.store.update(job_id, state=RUNNING)
+        # The log may have aged out of the LRU while the job sat queued
+        events = self._event_logs.get(job_id)
+        if events is None:
+            events = JobEventLog()
+            self._event_logs.set(job_id, events)
+
+        def _progress(stage, **counts):
+            self.store.update(job_id, stage=stage, progress=counts)
+            events.append("stage", {"stage": stage, **counts})
+
+        def _emit(event, **data):
+            events.append(event, data)
+
+        try:
+            result = run(_progress, _emit)
+        except Exception as e:
+            print(f"Classification job {job_id} failed: {e}")
+            self.store.update(job_id, state=FAILED, error=str(e))
+        else:
+            self.store.update(job_id, state=SUCCEEDED, result=result)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        return self.store.get(job_id)
+
+    def events(self, job_id: str) -> Optional[JobEventLog]:
+        """The job's event log, or None once it has been evicted."""
+        return self._event_logs.get(job_id)
+
+    def shutdown(self, timeout: float = CLASSIFY_SHUTDOWN_TIMEOUT):
+        """
+        Stop taking jobs, cancel queued ones and wait up to timeout seconds
+        for running ones. Jobs still running after that fail once the
+        classifier shuts down underneath them, or get reaped if the process
+        dies first.
+        """
+        self._stop.set()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        # Cancelled jobs never start; report them now rather than when stale
+        self.store.interrupt_queued(self.owner)
+        with self._futures_lock:
+            running = list(self._futures)
+        _, still_running = wait(running, timeout=timeout)
+        if still_running:
+            print(f"{len(still_running)} classification jobs still running after {timeout:.0f}s shutdown wait")
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+    return _queue
+
+
+def shutdown_job_queue():
+    global _queue
+    with _queue_lock:
+        queue, _queue = _queue, None
+    if queue is not None:
+        queue.shutdown()
@@ -3,19 +3,21 @@ import React from "react";
 
 interface Props {
   onClick: () => void;
+  disabled?: boolean;
 }
 
-export default function RefreshButton({ onClick }: Props) {
+export default function RefreshButton({ onClick, disabled }: Props) {
   return (
     <button
       onClick={onClick}
+      disabled={disabled}
       style={{
         padding: "0.5rem 1rem",
         fontSize: "1rem",
         border: "1px solid #333",
         borderRadius: "4px",
         backgroundColor: "#fff",
-        cursor: "pointer",
+        cursor: disabled ? "default" : "pointer",
       }}
     >
       Refresh
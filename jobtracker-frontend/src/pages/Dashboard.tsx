@@ -7,6 +7,7 @@ import {
   logout,
 } from "../services/api";
 import type { ApplicationsByStatus } from "../types/status";
+import { applyClassifiedResult } from "../types/status";
 import StatusTile from "../components/StatusTile";
 import RefreshButton from "../components/RefreshButton";
 import { useAuth } from "../AuthContext";
@@ -15,6 +16,8 @@ export default function Dashboard() {
   const [data, setData] = useState<ApplicationsByStatus | null>(null);
   const [loading, setLoading] = useState<boolean>(true);
   const [error, setError] = useState<string | null>(null);
+  const [refreshing, setRefreshing] = useState<boolean>(false);
+  const [progress, setProgress] = useState<string | null>(null);
   const navigate = useNavigate();
   const { setLoggedIn } = useAuth();
 
@@ -33,19 +36,35 @@ export default function Dashboard() {
       });
   }, []);
 
+  // Streamed events: each verdict is shown as soon as it arrives, and the
+  // final fetch replaces these provisional entries with what was saved
+  function handleClassifyEvent(event: string, payload: any) {
+    if (event === "stats") {
+      const counts = payload.counts ?? {};
+      setProgress(
+        `${counts.fetched ?? 0} emails fetched, ${counts.classified ?? 0} classified ` +
+          `(${payload.emails_per_second} emails/s)`
+      );
+    } else if (payload?.result) {
+      setData((current) => current && applyClassifiedResult(current, payload.result));
+    }
+  }
+
   async function handleRefresh() {
-    setLoading(true);
+    setRefreshing(true);
+    setProgress(null);
     setError(null);
     try {
       console.log("Classifying Emails")
-      const refreshed = await classifyAndRefresh();
+      const refreshed = await classifyAndRefresh("google", undefined, handleClassifyEvent);
       console.log("Recieved Classified Emails")
       setData(refreshed);
     } catch (e) {
       console.error(e);
       setError("Refresh failed.");
     } finally {
-      setLoading(false);
+      setRefreshing(false);
+      setProgress(null);
     }
   }
 
@@ -95,7 +114,12 @@ export default function Dashboard() {
       </header>
 
       <div style={{ marginTop: "1rem", marginBottom: "1rem" }}>
-        <RefreshButton onClick={handleRefresh} />
+        <RefreshButton onClick={handleRefresh} disabled={refreshing} />
+        {refreshing && (
+          <span style={{ marginLeft: "1rem" }}>
+            {progress ?? "Classifying emails…"}
+          </span>
+        )}
       </div>
 
       <div
@@ -55,9 +55,106 @@ export async function fetchApplicationsByStatus(): Promise<ApplicationsByStatus>
 
 export type Provider = "google" | "microsoft" | "both";
 
+export interface ClassifyJob {
+  job_id: string;
+  provider: Provider;
+  state: "queued" | "running" | "succeeded" | "failed" | "interrupted";
+  stage: string | null;
+  progress: Record<string, unknown>;
+  result: Record<string, unknown> | null;
+  error: string | null;
+}
+
+const CLASSIFY_POLL_MS = 2000;
+
+export async function fetchClassifyJob(jobId: string): Promise<ClassifyJob> {
+  const res = await fetch(`${BASE_URL}/classify/${jobId}`, {
+    method: "GET",
+    credentials: "include",
+  });
+  if (!res.ok) {
+    throw new Error(`Failed to fetch classification job: ${res.statusText}`);
+  }
+  return (await res.json()) as ClassifyJob;
+}
+
+const CLASSIFY_EVENTS = [
+  "stage",
+  "fetched",
+  "skipped",
+  "template",
+  "classified",
+  "failed",
+  "upserted",
+  "stats",
+];
+
+export interface ClassifyJobEnd {
+  state: ClassifyJob["state"];
+  result: Record<string, unknown> | null;
+  error: string | null;
+}
+
+/**
+ * Subscribe to a classification job's Server-Sent Events. onEvent receives
+ * each per-email event as it happens; onEnd receives the job's final state.
+ * onError is called if the stream can't be opened (the browser retries
+ * dropped connections by itself). Returns a function that closes the stream.
+ */
+export function streamClassifyJob(
+  jobId: string,
+  onEvent: (event: string, data: any) => void,
+  onEnd?: (data: ClassifyJobEnd) => void,
+  onError?: () => void
+): () => void {
+  const source = new EventSource(`${BASE_URL}/classify/${jobId}/events`, {
+    withCredentials: true,
+  });
+  for (const name of CLASSIFY_EVENTS) {
+    source.addEventListener(name, (e) => onEvent(name, JSON.parse((e as MessageEvent).data)));
+  }
+  source.addEventListener("end", (e) => {
+    source.close();
+    onEnd?.(JSON.parse((e as MessageEvent).data));
+  });
+  source.onerror = () => {
+    if (source.readyState === EventSource.CLOSED) {
+      onError?.();
+    }
+  };
+  return () => source.close();
+}
+
+async function pollClassifyJob(jobId: string): Promise<ClassifyJobEnd> {
+  let job = await fetchClassifyJob(jobId);
+  while (job.state === "queued" || job.state === "running") {
+    await new Promise((resolve) => setTimeout(resolve, CLASSIFY_POLL_MS));
+    job = await fetchClassifyJob(jobId);
+  }
+  return job;
+}
+
+function streamUntilDone(
+  jobId: string,
+  onEvent: (event: string, data: any) => void
+): Promise<ClassifyJobEnd> {
+  return new Promise((resolve, reject) => {
+    streamClassifyJob(jobId, onEvent, resolve, () =>
+      reject(new Error("Classification stream unavailable"))
+    );
+  });
+}
+
+/**
+ * Start a classification run and wait for it to finish, then return the
+ * refreshed applications. When onEvent is given the run is followed over
+ * Server-Sent Events, so callers can show results as they arrive; otherwise
+ * (or if the stream can't be opened) the job is polled.
+ */
 export async function classifyAndRefresh(
-  provider: Provider,
-  accessToken?: string
+  provider: Provider = "google",
+  accessToken?: string,
+  onEvent?: (event: string, data: any) => void
 ): Promise<ApplicationsByStatus> {
   const body: any = { provider };
   if (accessToken) {
@@ -74,6 +171,22 @@ export async function classifyAndRefresh(
   if (!res.ok) {
     throw new Error(`Classification failed: ${res.statusText}`);
   }
+  const { job_id } = await res.json();
+
+  // The run happens in the background; follow it until it finishes
+  let outcome: ClassifyJobEnd;
+  if (onEvent && typeof EventSource !== "undefined") {
+    try {
+      outcome = await streamUntilDone(job_id, onEvent);
+    } catch {
+      outcome = await pollClassifyJob(job_id);
+    }
+  } else {
+    outcome = await pollClassifyJob(job_id);
+  }
+  if (outcome.state !== "succeeded") {
+    throw new Error(`Classification ${outcome.state}: ${outcome.error ?? "unknown error"}`);
+  }
   return await fetchApplicationsByStatus();
 }
 
@@ -34,4 +34,35 @@ export interface ApplicationsByStatus {
   Interview: InterviewRecord[];
   Offer: OfferRecord[];
   Rejected: RejectedRecord[];
-}
\ No newline at end of file
+}
+
+export type ApplicationStatus = keyof ApplicationsByStatus;
+
+/**
+ * Place one streamed extraction result (company_name, job_title,
+ * application_status and dates) in its status list, removing any earlier
+ * entry for the same application. Results with another status are ignored.
+ */
+export function applyClassifiedResult(
+  data: ApplicationsByStatus,
+  result: any
+): ApplicationsByStatus {
+  const status = result.application_status as ApplicationStatus;
+  if (!(status in data) || !result.company_name || !result.job_title) {
+    return data;
+  }
+  const same = (rec: { company_name: string; job_title: string }) =>
+    rec.company_name === result.company_name && rec.job_title === result.job_title;
+  const next = {
+    Applied: data.Applied.filter((rec) => !same(rec)),
+    Interview: data.Interview.filter((rec) => !same(rec)),
+    Offer: data.Offer.filter((rec) => !same(rec)),
+    Rejected: data.Rejected.filter((rec) => !same(rec)),
+  };
+  const previous = [...data.Applied, ...data.Interview, ...data.Offer, ...data.Rejected].find(same) as any;
+  next[status] = [
+    ...next[status],
+    { ...previous, ...Object.fromEntries(Object.entries(result).filter(([, v]) => v != null)) },
+  ] as any;
+  return next;
+}
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Optional, Tuple
+
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3")
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "50000"))
+LLM_CACHE_MAX_AGE_SECONDS = int(os.getenv("LLM_CACHE_MAX_AGE_SECONDS", str(30 * 24 * 3600)))
+
+# Fields that change without the email's content changing (read state,
+# stars) and must not affect the cache key
+_VOLATILE_FIELDS = {"label", "star"}
+
+
+def normalize_email_text(email) -> str:
+    if isinstance(email, dict):
+        email = "\n".join(
+            f"{field}: {value}" for field, value in sorted(email.items()) if field not in _VOLATILE_FIELDS
+        )
+    return re.sub(r"\s+", " ", str(email)).strip()
+
+
+def cache_key(email, prompt_version: str, model: str) -> str:
+    digest = hashlib.sha256()
+    for part in (prompt_version, model, normalize_email_text(email)):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    """
+    On-disk cache of parsed extract_application_info results, keyed by
+    cache_key(). "Not a job email" verdicts are stored as JSON null so they
+    are cached too. Entries older than max_age_seconds are dropped, and the
+    least recently used ones go once max_entries is exceeded.
+    """
+
+    def __init__(self, path: str = LLM_CACHE_PATH, max_entries: int = LLM_CACHE_MAX_ENTRIES, max_age_seconds: int = LLM_CACHE_MAX_AGE_SECONDS):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS extraction_cache (
+                key TEXT PRIMARY KEY,
+                result TEXT,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_extraction_cache_last_used ON extraction_cache (last_used)")
+        self._conn.commit()
+        self.evict()
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """Return (hit, result); result may legitimately be None on a hit."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result FROM extraction_cache WHERE key = ? AND created_at >= ?",
+                (key, now - self.max_age_seconds),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return False, None
+            self._conn.execute("UPDATE extraction_cache SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return True, json.loads(row[0])
+
+    def put(self, key: str, result: Optional[dict]):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO extraction_cache (key, result, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(result), now, now),
+            )
+            self._conn.commit()
+
+    def evict(self):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM extraction_cache WHERE created_at < ?",
+                (time.time() - self.max_age_seconds,),
+            )
+            self._conn.execute("""
+                DELETE FROM extraction_cache WHERE key IN (
+                    SELECT key FROM extraction_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM extraction_cache").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "size": size}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_extraction_cache() -> ExtractionCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ExtractionCache()
+    return _cache
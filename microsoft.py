@@ -1,5 +1,8 @@
 import os
+import time
 import webbrowser
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 import msal
 import httpx
 from dotenv import load_dotenv
@@ -7,6 +10,15 @@ from dotenv import load_dotenv
 load_dotenv()
 MS_GRAPH_BASE_URL = 'https://graph.microsoft.com/v1.0'
 
+# Only the fields download_outlook_emails reads
+OUTLOOK_MESSAGE_FIELDS = 'id,conversationId,subject,from,receivedDateTime,bodyPreview'
+# Graph serves up to 1000 messages per page; fewer pages means fewer round trips
+GRAPH_MAX_PAGE_SIZE = 1000
+GRAPH_TIMEOUT = httpx.Timeout(30.0, connect=10.0)
+GRAPH_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10)
+# Retries for throttled (429/503) Graph requests
+GRAPH_MAX_RETRIES = int(os.getenv("GRAPH_MAX_RETRIES", "3"))
+
 def get_access_token (application_id, client_secret, scopes):
     client=msal.ConfidentialClientApplication(
     client_id=application_id,
@@ -47,33 +59,112 @@ def get_access_token (application_id, client_secret, scopes):
             raise Exception('Failed to acquire access token: ' + str(token_response))
         
 
-def search_messages(headers, search_query, filter=None, folder_id=None, fields='*', top=5, max_results=100):
-    print('Setting Endpoint')
-    if folder_id is None:
-        endpoint = f'{MS_GRAPH_BASE_URL}/me/messages'
-    else:
-        endpoint = f'{MS_GRAPH_BASE_URL}/me/mailFolders/{folder_id}/messages'
-    print('Formulating Search Query')
+def _search_params(search_query, filter, fields, top):
     params = {
         '$search': f'"{search_query}"',
-        '$filter': filter,
         '$select': fields,
-        '$top': min(top, max_results),
+        '$top': top,
     }
+    if filter:
+        params['$filter'] = filter
+    return params
+
+def _messages_endpoint(folder_id=None):
+    if folder_id is None:
+        return f'{MS_GRAPH_BASE_URL}/me/messages'
+    return f'{MS_GRAPH_BASE_URL}/me/mailFolders/{folder_id}/messages'
+
+class DeltaTokenExpiredError(Exception):
+    """Graph rejected a stored delta link (410 Gone); a full resync is needed."""
+
+_sync_client = None
+
+def _get_sync_client() -> httpx.Client:
+    global _sync_client
+    if _sync_client is None:
+        _sync_client = httpx.Client(http2=True, limits=GRAPH_LIMITS, timeout=GRAPH_TIMEOUT)
+    return _sync_client
+
+def close_graph_client():
+    global _sync_client
+    client, _sync_client = _sync_client, None
+    if client is not None:
+        client.close()
+
+def retry_after_seconds(value, default: float) -> float:
+    """Parse a Retry-After header: delay-seconds or an HTTP-date."""
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return default
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    return default
+
+def _graph_get(client: httpx.Client, url, headers, params=None, max_retries: int = GRAPH_MAX_RETRIES) -> httpx.Response:
+    for attempt in range(max_retries + 1):
+        response = client.get(url, headers=headers, params=params)
+        # Graph throttles with 429/503 and tells us how long to back off
+        if response.status_code in (429, 503) and attempt < max_retries:
+            time.sleep(retry_after_seconds(response.headers.get('Retry-After'), 2 ** attempt))
+            continue
+        return response
+
+def search_messages(headers, search_query, filter=None, folder_id=None, fields=OUTLOOK_MESSAGE_FIELDS, top=GRAPH_MAX_PAGE_SIZE, max_results=100):
+    endpoint = _messages_endpoint(folder_id)
+    params = _search_params(search_query, filter, fields, min(top, max_results))
+    client = _get_sync_client()
     messages = []
     next_link = endpoint
     while next_link and len(messages) < max_results:
-        response = httpx.get(next_link, headers=headers, params=params)
+        response = _graph_get(client, next_link, headers, params)
         response.raise_for_status()
-        if response.status_code != 200:
-            raise Exception(f'Failed to retrieve emails: {response.json()}')
-    
+
         json_response = response.json()
         messages.extend(json_response.get('value', []))
+        # nextLink already carries the query, including $skiptoken
         next_link = json_response.get('@odata.nextLink', None)
-        params=None # Clear params for subsequent requests
-        if next_link and len(messages) + top > max_results:
-            params = {
-            '$top': max_results - len(messages)
-            }
-    return messages[:max_results]
\ No newline at end of file
+        params = None
+    return messages[:max_results]
+
+def delta_messages(headers, delta_link=None, folder_id='inbox', fields=OUTLOOK_MESSAGE_FIELDS, received_after=None, page_size=GRAPH_MAX_PAGE_SIZE):
+    """
+    Run a Graph delta query over a mail folder.
+
+    With a delta_link from a previous call only messages created or changed
+    since then are returned; without one this is an initial sync, optionally
+    limited to messages received after `received_after` (ISO 8601).
+    Returns (messages, new_delta_link). Deleted messages come back with an
+    '@removed' key. Raises DeltaTokenExpiredError if delta_link is no longer
+    valid.
+    """
+    client = _get_sync_client()
+    # Delta queries ignore $top; page size is negotiated through Prefer
+    headers = {**headers, 'Prefer': f'odata.maxpagesize={page_size}'}
+    if delta_link:
+        next_link, params = delta_link, None
+    else:
+        next_link = f'{MS_GRAPH_BASE_URL}/me/mailFolders/{folder_id}/messages/delta'
+        params = {'$select': fields}
+        if received_after:
+            params['$filter'] = f'receivedDateTime ge {received_after}'
+
+    messages = []
+    new_delta_link = None
+    while next_link:
+        response = _graph_get(client, next_link, headers, params)
+        if response.status_code == 410:
+            raise DeltaTokenExpiredError(response.text)
+        response.raise_for_status()
+        json_response = response.json()
+        messages.extend(json_response.get('value', []))
+        next_link = json_response.get('@odata.nextLink')
+        new_delta_link = json_response.get('@odata.deltaLink', new_delta_link)
+        params = None
+    return messages, new_delta_link
@@ -0,0 +1,250 @@
+import hashlib
+import json
+import os
+import random
+import re
+import sqlite3
+import struct
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from extraction import STATUS_DATE_FIELDS
+
+NEAR_DUP_INDEX_PATH = os.getenv("NEAR_DUP_INDEX_PATH", "near_dup_index.sqlite3")
+NEAR_DUP_MAX_TEMPLATES = int(os.getenv("NEAR_DUP_MAX_TEMPLATES", "5000"))
+# Minimum estimated Jaccard similarity for two emails to count as one template
+NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", "0.8"))
+
+NUM_PERM = 64
+BANDS = 8
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 3
+# Short emails share too few shingles for the estimate to be trustworthy
+MIN_SHINGLES = 20
+
+_PRIME = (1 << 61) - 1
+_rng = random.Random(1729)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+
+def _shingles(text: str):
+    # Capitalized runs are where company and role names sit in a template;
+    # collapsing them to one placeholder lets filled-in copies line up
+    text = re.sub(r"\b[A-Z][\w&.'\-]*(?:\s+[A-Z][\w&.'\-]*)*", "X", text)
+    text = re.sub(r"\d+", "0", text.lower())
+    words = re.findall(r"\w+", text)
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(max(0, len(words) - SHINGLE_SIZE + 1))}
+
+
+def minhash_signature(text: str) -> Optional[Tuple[int, ...]]:
+    """MinHash signature of text's word shingles, or None if it's too short."""
+    shingles = _shingles(text)
+    if len(shingles) < MIN_SHINGLES:
+        return None
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big") for s in shingles]
+    return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+
+def estimated_similarity(sig_a, sig_b) -> float:
+    return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / NUM_PERM
+
+
+def _band_keys(signature):
+    for band in range(BANDS):
+        rows = signature[band * ROWS:(band + 1) * ROWS]
+        yield band, hashlib.blake2b(struct.pack(f">{ROWS}Q", *rows), digest_size=8).hexdigest()
+
+
+_SENDER_NOISE = re.compile(r"\b(careers?|recruiting|recruitment|talent( acquisition)?|hiring|team|jobs|hr|no-?reply|notifications?)\b", re.IGNORECASE)
+# Senders that are the ATS or job board itself rather than the employer
+_ATS_SENDER_NAMES = {"greenhouse", "lever", "workday", "ashby", "smartrecruiters", "icims", "jobvite", "linkedin", "indeed"}
+# Words are joined by spaces/tabs only, so a name never runs onto the next line
+_NAME = r"[A-Z][\w&'\-/+()]*(?:[ \t]+(?:of[ \t]+|&[ \t]+)?[A-Z][\w&'\-/+()]*){0,4}"
+# Most reliable first: "at <Company>" names the employer even in
+# "applying to <Role> at <Company>", where "to <X>" would give the role
+_COMPANY_PATTERNS = [re.compile(p) for p in (
+    rf"\bat[ \t]+(?P<company>{_NAME})",
+    rf"\b(?:with|joining|interest in)[ \t]+(?P<company>{_NAME})",
+    rf"\bto[ \t]+(?P<company>{_NAME})",
+)]
+_TITLE_PATTERNS = [re.compile(p) for p in (
+    rf"(?P<title>{_NAME})[ \t]+(?:position|role|job|opening|opportunity)\b",
+    rf"\b[Aa]pplication for[ \t]+(?:the[ \t]+|an?[ \t]+)?(?P<title>{_NAME})",
+)]
+# Capitalized words that start sentences or greetings, never a name
+_NOT_NAME_WORDS = {"the", "this", "our", "your", "us", "we", "you", "hi", "hello", "dear", "thank", "thanks", "unfortunately", "a", "an"}
+
+
+def _clean_name(name: Optional[str]) -> Optional[str]:
+    if not name:
+        return None
+    name = name.strip()
+    if name.split()[0].lower() in _NOT_NAME_WORDS:
+        return None
+    return name
+
+
+def _sender_company(sender: str) -> Optional[str]:
+    name = re.sub(r"[(<].*", "", sender or "").strip().strip('"')
+    name = _SENDER_NOISE.sub("", name).strip(" -@|,")
+    if not name or name.lower() in _ATS_SENDER_NAMES:
+        return None
+    return name
+
+
+def _overlaps(a: str, b: str) -> bool:
+    a, b = a.lower(), b.lower()
+    return a in b or b in a
+
+
+def extract_slots(email) -> Dict[str, Optional[str]]:
+    """
+    Cheap regex guesses for company_name and job_title from subject/body/sender.
+    A slot is None when no match is trustworthy.
+    """
+    subject = str(email.get("subject") or "")
+    text = f"{subject}\n{email.get('body') or email.get('snippet') or ''}"[:2000]
+    title = None
+    for pattern in _TITLE_PATTERNS:
+        title = next((t for t in (_clean_name(m.group("title")) for m in pattern.finditer(text)) if t), None)
+        if title:
+            break
+    company = None
+    for pattern in _COMPANY_PATTERNS:
+        for match in pattern.finditer(text):
+            candidate = _clean_name(match.group("company"))
+            # "applying to Data Scientist" names the role, not the employer
+            if candidate and not (title and _overlaps(candidate, title)):
+                company = candidate
+                break
+        if company:
+            break
+    company = company or _sender_company(email.get("sender"))
+    if company and title and _overlaps(company, title):
+        company = None
+    return {"company_name": company, "job_title": title}
+
+
+def reuse_template_result(template_result, email) -> Tuple[bool, Optional[Dict[str, Any]]]:
+    """
+    Adapt a template's stored answer to a new email. Returns (ok, result);
+    ok is False when the company/title slots couldn't be filled and the
+    email should go to the LLM after all.
+    """
+    if template_result is None:
+        return True, None
+    slots = extract_slots(email)
+    if not slots["company_name"] or not slots["job_title"]:
+        return False, None
+    result = {**template_result, **slots}
+    # Dates describe when *this* email arrived, not the template's
+    for field in STATUS_DATE_FIELDS.values():
+        result[field] = None
+    status_field = STATUS_DATE_FIELDS.get(result.get("application_status"))
+    if status_field:
+        result[status_field] = email.get("date")
+    return True, result
+
+
+class NearDuplicateIndex:
+    """
+    Persistent MinHash/LSH index of previously classified emails and their
+    extraction results. Holds at most max_templates entries, evicting the
+    least recently matched ones.
+    """
+
+    def __init__(self, path: str = NEAR_DUP_INDEX_PATH, max_templates: int = NEAR_DUP_MAX_TEMPLATES, threshold: float = NEAR_DUP_THRESHOLD):
+        self.max_templates = max_templates
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS templates (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                signature TEXT NOT NULL,
+                result TEXT,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS buckets (
+                band INTEGER NOT NULL,
+                bucket TEXT NOT NULL,
+                template_id INTEGER NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_buckets_band_bucket ON buckets (band, bucket)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_buckets_template ON buckets (template_id)")
+        self._conn.commit()
+
+    def lookup(self, signature) -> Tuple[bool, Any]:
+        """Return (hit, template_result) for the most similar known template."""
+        if signature is None:
+            return False, None
+        with self._lock:
+            candidates = set()
+            for band, bucket in _band_keys(signature):
+                rows = self._conn.execute(
+                    "SELECT template_id FROM buckets WHERE band = ? AND bucket = ?", (band, bucket)
+                ).fetchall()
+                candidates.update(row[0] for row in rows)
+            best = None
+            for template_id in candidates:
+                row = self._conn.execute("SELECT signature, result FROM templates WHERE id = ?", (template_id,)).fetchone()
+                if row is None:
+                    continue
+                similarity = estimated_similarity(signature, json.loads(row[0]))
+                if similarity >= self.threshold and (best is None or similarity > best[0]):
+                    best = (similarity, template_id, row[1])
+            if best is None:
+                self.misses += 1
+                return False, None
+            self._conn.execute("UPDATE templates SET last_used = ? WHERE id = ?", (time.time(), best[1]))
+            self._conn.commit()
+            self.hits += 1
+        return True, json.loads(best[2])
+
+    def add(self, signature, result: Optional[dict]):
+        if signature is None:
+            return
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO templates (signature, result, last_used) VALUES (?, ?, ?)",
+                (json.dumps(signature), json.dumps(result), time.time()),
+            )
+            self._conn.executemany(
+                "INSERT INTO buckets (band, bucket, template_id) VALUES (?, ?, ?)",
+                [(band, bucket, cursor.lastrowid) for band, bucket in _band_keys(signature)],
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        stale = self._conn.execute(
+            "SELECT id FROM templates ORDER BY last_used DESC LIMIT -1 OFFSET ?", (self.max_templates,)
+        ).fetchall()
+        if stale:
+            ids = [(row[0],) for row in stale]
+            self._conn.executemany("DELETE FROM buckets WHERE template_id = ?", ids)
+            self._conn.executemany("DELETE FROM templates WHERE id = ?", ids)
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM templates").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "size": size}
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_near_dup_index() -> NearDuplicateIndex:
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = NearDuplicateIndex()
+    return _index
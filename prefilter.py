@@ -0,0 +1,207 @@
+# Cheap CPU-only pre-filter that drops obvious non-job emails (newsletters,
+# card offers, receipts) before they cost an LLM call in extract_emails.
+# Tuned to keep anything uncertain: a false "keep" costs one LLM call, a
+# false "drop" loses an application.
+import math
+import os
+import re
+from collections import Counter
+
+# Applicant tracking systems that send application mail on behalf of employers
+ATS_SIGNATURES = (
+    "greenhouse.io", "greenhouse-mail.io", "lever.co", "hire.lever.co",
+    "myworkday.com", "workday.com", "myworkdayjobs.com", "smartrecruiters.com",
+    "icims.com", "jobvite.com", "ashbyhq.com", "taleo.net", "successfactors.com",
+    "bamboohr.com", "workablemail.com", "workable.com", "recruitee.com",
+    "applytojob.com", "breezy.hr", "eightfold.ai", "oraclecloud.com",
+    "paradox.ai", "teamtailor.com", "personio.de", "jazzhr.com",
+)
+
+JOB_SUBJECT_PATTERNS = [re.compile(p, re.IGNORECASE) for p in (
+    r"\bthanks?( you)? for (your )?(applying|application|interest)\b",
+    r"\b(your|job) application\b",
+    r"\bapplication (received|submitted|status|update|confirmation)\b",
+    r"\binterview\b",
+    r"\boffer (letter|of employment)\b",
+    r"\bnext steps\b",
+    r"\b(online|coding|technical) assessment\b",
+    r"\bwe('ve| have) received your\b",
+)]
+
+NON_JOB_PATTERNS = [re.compile(p, re.IGNORECASE) for p in (
+    r"\bcredit card\b", r"\bcard ?member\b", r"\bpre-?approved\b", r"\bapr\b",
+    r"\breceipt\b", r"\byour order\b", r"\border (confirmation|#)", r"\bshipped\b",
+    r"\bstatement is (ready|available)\b", r"\b\d+% off\b", r"\bsale\b",
+    r"\bnewsletter\b", r"\bwebinar\b", r"\bloan\b", r"\bmortgage\b",
+    r"\b(visa|passport|permit) application\b",
+)]
+
+MARKETING_SENDER_PATTERNS = [re.compile(p, re.IGNORECASE) for p in (
+    r"\b(newsletter|news|promo|promotions|marketing|deals|offers|sales)@",
+    r"@(e|em|email|mail|info|news)\.",
+)]
+
+# Seed corpus for the lexical model: short, representative texts of each class
+_SEED_JOB = (
+    "thank you for applying to the software engineer position we have received your application",
+    "your application for data scientist has been submitted our recruiting team will review",
+    "we would like to invite you to interview for the role please share your availability",
+    "unfortunately we have decided to move forward with other candidates for this position",
+    "after careful consideration we will not be moving forward with your candidacy",
+    "we are pleased to extend an offer of employment for the position of analyst",
+    "next steps in your application please complete the online assessment",
+    "thank you for your interest in joining our team we received your application",
+    "your application status has been updated for the machine learning engineer role",
+    "the hiring manager would like to schedule a phone screen with you",
+    "we appreciate the time you took to apply for the internship",
+    "application received product manager job id requisition",
+    "congratulations you have been selected for the final round interview",
+    "your candidate profile has been reviewed by the recruiter",
+)
+_SEED_OTHER = (
+    "your credit card application has been approved enjoy your new card benefits",
+    "get 20 off your next order limited time sale ends tonight",
+    "your order has shipped track your package delivery",
+    "your monthly statement is ready to view online banking",
+    "receipt for your payment thank you for your purchase",
+    "join our free webinar to learn about marketing strategies",
+    "weekly newsletter top stories and trending articles this week",
+    "you are pre approved for a personal loan with low apr",
+    "your subscription will renew automatically update your billing details",
+    "security alert new sign in to your account from a new device",
+    "exclusive deals for members shop now and save",
+    "your visa application appointment has been scheduled at the consulate",
+    "rate your recent stay and earn reward points",
+    "reminder your bill payment is due soon",
+)
+
+
+def _tokens(text: str):
+    return re.findall(r"[a-z]{2,}", text.lower())
+
+
+class LexicalModel:
+    """Naive Bayes over the set of word tokens in an email."""
+
+    def __init__(self):
+        self._counts = {True: Counter(), False: Counter()}
+        self._docs = {True: 0, False: 0}
+
+    def train(self, texts, labels):
+        for text, is_job in zip(texts, labels):
+            self._docs[bool(is_job)] += 1
+            self._counts[bool(is_job)].update(set(_tokens(text)))
+        return self
+
+    def probability(self, text: str) -> float:
+        """Probability that text is a job-application email."""
+        total = self._docs[True] + self._docs[False]
+        if not total:
+            return 0.5
+        log_odds = math.log((self._docs[True] + 1) / (self._docs[False] + 1))
+        for token in set(_tokens(text)):
+            pos, neg = self._counts[True][token], self._counts[False][token]
+            if pos or neg:
+                log_odds += math.log((pos + 1) / (self._docs[True] + 2)) - math.log((neg + 1) / (self._docs[False] + 2))
+        log_odds = max(-30.0, min(30.0, log_odds))
+        return 1 / (1 + math.exp(-log_odds))
+
+
+def default_model() -> LexicalModel:
+    return LexicalModel().train(
+        _SEED_JOB + _SEED_OTHER,
+        [True] * len(_SEED_JOB) + [False] * len(_SEED_OTHER),
+    )
+
+
+def _email_fields(email):
+    """Return (subject, sender, text) for a Gmail details dict or an Outlook string."""
+    if isinstance(email, dict):
+        subject = str(email.get("subject") or "")
+        sender = str(email.get("sender") or "")
+        text = f"{subject}\n{email.get('snippet') or ''}\n{email.get('body') or ''}"
+        return subject, sender, text
+    text = str(email)
+    subject = re.search(r"Subject:\s*(.*)", text)
+    sender = re.search(r"From:\s*(.*)", text)
+    return (subject.group(1) if subject else ""), (sender.group(1) if sender else ""), text
+
+
+class PrefilterReport:
+    def __init__(self):
+        self.total = 0
+        self.kept = 0
+        self.dropped = 0
+        self.reasons = Counter()
+
+    @property
+    def llm_calls_saved(self) -> int:
+        return self.dropped
+
+    def as_dict(self) -> dict:
+        return {
+            "total": self.total,
+            "kept": self.kept,
+            "dropped": self.dropped,
+            "llm_calls_saved": self.llm_calls_saved,
+            "reasons": dict(self.reasons),
+        }
+
+
+class Prefilter:
+    """
+    drop_threshold: drop when the model's job probability is below this,
+        even without any negative signal.
+    negative_threshold: drop when a marketing/non-job pattern matched and
+        the job probability is below this.
+    """
+
+    def __init__(self, model: LexicalModel = None, drop_threshold: float = None, negative_threshold: float = None):
+        self.model = model or default_model()
+        self.drop_threshold = float(os.getenv("PREFILTER_DROP_THRESHOLD", "0.05")) if drop_threshold is None else drop_threshold
+        self.negative_threshold = float(os.getenv("PREFILTER_NEGATIVE_THRESHOLD", "0.6")) if negative_threshold is None else negative_threshold
+
+    def check(self, email):
+        """Return (keep, reason) for a single email."""
+        subject, sender, text = _email_fields(email)
+        sender_lower = sender.lower()
+        if any(signature in sender_lower for signature in ATS_SIGNATURES):
+            return True, "ats_sender"
+        if any(pattern.search(subject) for pattern in JOB_SUBJECT_PATTERNS):
+            return True, "job_subject"
+
+        probability = self.model.probability(text[:4000])
+        negative = (
+            any(pattern.search(subject) for pattern in NON_JOB_PATTERNS)
+            or any(pattern.search(sender) for pattern in MARKETING_SENDER_PATTERNS)
+        )
+        if negative and probability < self.negative_threshold:
+            return False, "non_job_pattern"
+        if probability < self.drop_threshold:
+            return False, "lexical_model"
+        return True, "lexical_model"
+
+    def split(self, emails, report: PrefilterReport = None):
+        """Return a keep/drop flag per email, recording counts in report."""
+        report = report if report is not None else PrefilterReport()
+        flags = []
+        for email in emails:
+            keep, reason = self.check(email)
+            report.total += 1
+            if keep:
+                report.kept += 1
+            else:
+                report.dropped += 1
+                report.reasons[reason] += 1
+            flags.append(keep)
+        return flags
+
+
+_prefilter = None
+
+
+def get_prefilter() -> Prefilter:
+    global _prefilter
+    if _prefilter is None:
+        _prefilter = Prefilter()
+    return _prefilter
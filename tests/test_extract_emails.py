@@ -0,0 +1,35 @@
+import utils
+from compaction import compact_email
+from extraction import LLM_MODEL, PROMPT_VERSION
+from llm_cache import ExtractionCache, cache_key
+from near_dup import NearDuplicateIndex
+
+EMAIL = {
+    "id": "m1",
+    "subject": "Your application to Acme",
+    "sender": "Acme Careers <jobs@acme.com>",
+    "body": "Thank you for applying to the Backend Engineer position at Acme.",
+    "date": "2024-05-02",
+}
+RESULT = {"company_name": "Acme", "job_title": "Backend Engineer", "application_status": "Applied"}
+
+
+def _cached(monkeypatch, tmp_path):
+    cache = ExtractionCache(path=str(tmp_path / "cache.sqlite3"))
+    cache.put(cache_key(compact_email(EMAIL), PROMPT_VERSION, LLM_MODEL), RESULT)
+    monkeypatch.setattr(utils, "get_extraction_cache", lambda: cache)
+    # Keeps the tests off the shared index file should anything reach it
+    index = NearDuplicateIndex(path=str(tmp_path / "near_dup.sqlite3"))
+    monkeypatch.setattr(utils, "get_near_dup_index", lambda: index)
+
+
+def test_cache_hit_without_on_event(monkeypatch, tmp_path):
+    _cached(monkeypatch, tmp_path)
+    assert utils.extract_emails([EMAIL]) == [RESULT]
+
+
+def test_cache_hit_reported_to_on_event(monkeypatch, tmp_path):
+    _cached(monkeypatch, tmp_path)
+    events = []
+    utils.extract_emails([EMAIL], on_event=lambda index, outcome, result: events.append((index, outcome, result)))
+    assert events == [(0, "cached", RESULT)]
@@ -0,0 +1,55 @@
+import socket
+import threading
+import time
+
+import jobs
+
+
+def _insert(store, job_id, owner, seen_at):
+    store._conn.execute(
+        "INSERT INTO classify_jobs (job_id, user_id, provider, state, created_at, updated_at, owner, heartbeat_at) "
+        "VALUES (?, 'u', 'google', 'running', ?, ?, ?, ?)",
+        (job_id, seen_at, seen_at, owner, seen_at),
+    )
+    store._conn.commit()
+
+
+def test_sibling_worker_start_keeps_running_jobs(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    release = threading.Event()
+    first = jobs.JobQueue(jobs.JobStore(path))
+    job_id, _ = first.submit("u", "google", lambda progress, emit: release.wait(5) and {"ok": True})
+    sibling = jobs.JobQueue(jobs.JobStore(path))
+    assert sibling.get(job_id)["state"] in (jobs.QUEUED, jobs.RUNNING)
+    # The sibling joins the live run instead of starting another
+    assert sibling.submit("u", "google", lambda progress, emit: None) == (job_id, True)
+    release.set()
+    for _ in range(50):
+        if first.get(job_id)["state"] == jobs.SUCCEEDED:
+            break
+        time.sleep(0.05)
+    assert first.get(job_id)["state"] == jobs.SUCCEEDED
+
+
+def test_reap_only_orphaned_jobs(tmp_path):
+    store = jobs.JobStore(str(tmp_path / "jobs.sqlite3"))
+    now = time.time()
+    _insert(store, "dead-pid", f"{socket.gethostname()}:999999999", now)
+    _insert(store, "stale", "elsewhere:1", now - 3600)
+    _insert(store, "live-remote", "elsewhere:1", now)
+    _insert(store, "live-local", jobs.process_owner(), now)
+    assert store.reap(stale_after=60) == 2
+    states = {job_id: store.get(job_id)["state"] for job_id in ("dead-pid", "stale", "live-remote", "live-local")}
+    assert states == {
+        "dead-pid": jobs.INTERRUPTED,
+        "stale": jobs.INTERRUPTED,
+        "live-remote": jobs.RUNNING,
+        "live-local": jobs.RUNNING,
+    }
+
+
+def test_shutdown_waits_for_running_jobs(tmp_path):
+    queue = jobs.JobQueue(jobs.JobStore(str(tmp_path / "jobs.sqlite3")))
+    job_id, _ = queue.submit("u", "google", lambda progress, emit: time.sleep(0.3) or {"ok": True})
+    queue.shutdown(timeout=5)
+    assert queue.get(job_id)["state"] == jobs.SUCCEEDED
@@ -0,0 +1,26 @@
+from email.utils import formatdate
+import time
+
+import httpx
+
+import microsoft
+
+
+def test_retry_after_seconds_and_http_date():
+    assert microsoft.retry_after_seconds("5", 1) == 5.0
+    assert 25 < microsoft.retry_after_seconds(formatdate(time.time() + 30, usegmt=True), 1) <= 30
+    assert microsoft.retry_after_seconds(formatdate(time.time() - 30, usegmt=True), 1) == 0.0
+    assert microsoft.retry_after_seconds("soon", 2) == 2
+    assert microsoft.retry_after_seconds(None, 4) == 4
+
+
+def test_throttled_requests_are_retried(monkeypatch):
+    responses = iter([
+        httpx.Response(429, headers={"Retry-After": formatdate(time.time(), usegmt=True)}),
+        httpx.Response(503, headers={"Retry-After": "0"}),
+        httpx.Response(200, json={"value": [{"id": "m1"}]}),
+    ])
+    client = httpx.Client(transport=httpx.MockTransport(lambda request: next(responses)))
+    monkeypatch.setattr(microsoft, "_get_sync_client", lambda: client)
+    monkeypatch.setattr(microsoft.time, "sleep", lambda seconds: None)
+    assert microsoft.search_messages({}, "Interview") == [{"id": "m1"}]
@@ -0,0 +1,103 @@
+from near_dup import extract_slots, reuse_template_result
+
+GREENHOUSE_RECEIVED = """Hi Jane,
+
+Thank you for your application to Acme
+Hi Jane, we're reviewing it now.
+
+Our team will be in touch about the Backend Engineer position if your
+experience is a match.
+
+Best,
+Acme Recruiting
+"""
+
+LEVER_NEXT_STEPS = """Dear Jane,
+
+We'd like to move forward with Stripe
+Dear Jane, please pick an interview slot using the link below.
+
+Thanks,
+The Stripe Team
+"""
+
+WORKDAY_RECEIVED = """Hello Jane,
+
+Thanks for applying to Data Scientist at Globex.
+We will review your Data Scientist application and reach out with next steps.
+
+Globex Talent Acquisition
+"""
+
+APPLICATION_FOR = """Hi Jane,
+
+We have received your application for the Senior Software Engineer role.
+Thank you for your interest in Initech.
+
+Regards,
+Initech Careers
+"""
+
+TEMPLATE_RESULT = {
+    "company_name": "Template Co",
+    "job_title": "Template Role",
+    "application_status": "Applied",
+    "date_applied": "2024-01-01",
+    "date_rejected": None,
+    "interview_date": None,
+    "offer_date": None,
+}
+
+
+def _email(body, subject="Your application", sender="Careers <no-reply@greenhouse.io>"):
+    return {"subject": subject, "body": body, "sender": sender, "date": "2024-05-02"}
+
+
+def test_company_stops_at_end_of_line():
+    slots = extract_slots(_email(GREENHOUSE_RECEIVED))
+    assert slots == {"company_name": "Acme", "job_title": "Backend Engineer"}
+
+
+def test_company_after_with_stops_at_end_of_line():
+    slots = extract_slots(_email(LEVER_NEXT_STEPS, subject="Next steps"))
+    assert slots["company_name"] == "Stripe"
+    assert slots["job_title"] is None
+
+
+def test_at_company_preferred_over_to_role():
+    slots = extract_slots(_email(WORKDAY_RECEIVED, sender="Workday <no-reply@myworkday.com>"))
+    assert slots["company_name"] == "Globex"
+    assert slots["company_name"] != "Data Scientist"
+
+
+def test_application_for_title():
+    slots = extract_slots(_email(APPLICATION_FOR))
+    assert slots == {"company_name": "Initech", "job_title": "Senior Software Engineer"}
+
+
+def test_ats_sender_is_not_a_company():
+    slots = extract_slots(_email("Thanks for applying.\nWe'll be in touch.", sender="Greenhouse <no-reply@greenhouse.io>"))
+    assert slots["company_name"] is None
+
+
+def test_reuse_fills_slots_and_dates_from_new_email():
+    ok, result = reuse_template_result(TEMPLATE_RESULT, _email(GREENHOUSE_RECEIVED))
+    assert ok
+    assert result["company_name"] == "Acme"
+    assert result["job_title"] == "Backend Engineer"
+    assert result["application_status"] == "Applied"
+    assert result["date_applied"] == "2024-05-02"
+
+
+def test_missing_slot_goes_to_llm():
+    # No title can be found, so the template's verdict is not reused
+    ok, result = reuse_template_result(TEMPLATE_RESULT, _email(LEVER_NEXT_STEPS))
+    assert not ok
+    assert result is None
+
+
+def test_company_overlapping_title_is_rejected():
+    body = "We received your application.\nThanks for your interest in the Data Scientist position at our team."
+    slots = extract_slots(_email(body, sender="Data Scientist <no-reply@greenhouse.io>"))
+    assert slots["job_title"] == "Data Scientist"
+    assert slots["company_name"] is None
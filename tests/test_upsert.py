@@ -0,0 +1,49 @@
+from sqlalchemy import create_engine, text
+
+from classify import upsert_applications
+from db import MIGRATIONS, run_migrations
+
+SELECT_ROWS = text("""
+    SELECT company_name, application_status, date_applied, date_rejected, interview_date, offer_date
+    FROM job_applications ORDER BY company_name
+""")
+
+
+def test_folded_statuses_keep_every_date():
+    engine = create_engine("sqlite://")
+    run_migrations(engine)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO job_applications (job_id, company_name, job_title, application_status) VALUES ('x', 'Acme', 'Eng', 'Applied')"))
+        upsert_applications(conn, [
+            {"company_name": "Acme", "job_title": "Eng", "application_status": "Applied", "date_applied": "2024-01-01"},
+            # Only the status's own date is taken from an existing key's update
+            {"company_name": "Acme", "job_title": "Eng", "application_status": "Interview",
+             "interview_date": "2024-02-01", "date_applied": "2023-12-01"},
+            # The latest-dated status wins, whatever order the emails came in
+            {"company_name": "Globex", "job_title": "PM", "application_status": "Rejected",
+             "date_rejected": "2024-03-05", "date_applied": "2024-03-01"},
+            {"company_name": "Globex", "job_title": "PM", "application_status": "Applied", "date_applied": "2024-03-01"},
+        ])
+        rows = conn.execute(SELECT_ROWS).fetchall()
+    assert rows == [
+        ("Acme", "Interview", "2024-01-01", None, "2024-02-01", None),
+        ("Globex", "Rejected", "2024-03-01", "2024-03-05", None, None),
+    ]
+
+
+def test_dedupe_migration_merges_duplicates():
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        for _, statements in MIGRATIONS[:2]:
+            for statement in statements:
+                conn.execute(text(statement))
+        conn.execute(text("""
+            INSERT INTO job_applications VALUES
+                ('b', '2024-01-01', 'Acme', 'Eng', 'Applied', NULL, NULL, NULL),
+                ('a', NULL, 'Acme', 'Eng', 'Interview', NULL, '2024-02-01', NULL),
+                ('c', '2023-12-01', 'Acme', 'Eng', 'Rejected', '2024-01-15', NULL, NULL)
+        """))
+        for statement in MIGRATIONS[2][1]:
+            conn.execute(text(statement))
+        rows = conn.execute(SELECT_ROWS).fetchall()
+    assert rows == [("Acme", "Interview", "2024-01-01", "2024-01-15", "2024-02-01", None)]
@@ -0,0 +1,52 @@
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+# How many earlier messages of a conversation are summarized for the LLM
+THREAD_CONTEXT_MESSAGES = 5
+_OLDEST = datetime.min.replace(tzinfo=timezone.utc)
+
+
+def _received_at(email) -> datetime:
+    value = str(email.get('date') or '')
+    try:
+        parsed = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        try:
+            parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return _OLDEST
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _summarize(email) -> str:
+    snippet = ' '.join(str(email.get('snippet') or '').split())[:160]
+    return f"- {email.get('date', '')} | {email.get('sender', '')} | {email.get('subject', '')} | {snippet}"
+
+
+def latest_per_thread(emails):
+    """
+    Collapse a list of email dicts to one per conversation (Gmail threadId /
+    Outlook conversationId): the newest message, with a short summary of the
+    earlier ones under 'thread_context'. Emails without a thread ID are kept
+    as they are. Conversations keep the order in which they first appear.
+    """
+    threads = {}
+    for position, email in enumerate(emails):
+        thread_id = email.get('thread_id') if isinstance(email, dict) else None
+        threads.setdefault(thread_id if thread_id else ('single', position), []).append(email)
+
+    latest = []
+    for messages in threads.values():
+        if len(messages) == 1:
+            latest.append(messages[0])
+            continue
+        messages = sorted(messages, key=_received_at)
+        earlier = messages[:-1][-THREAD_CONTEXT_MESSAGES:]
+        latest.append({
+            **messages[-1],
+            'thread_context': (
+                f"Earlier messages in this conversation ({len(messages) - 1}, oldest first):\n"
+                + "\n".join(_summarize(email) for email in earlier)
+            ),
+        })
+    return latest
@@ -0,0 +1,138 @@
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Optional
+
+from ttl_cache import TTLCache
+
+# "memory" keeps tokens in this process only; "sqlite" shares them between
+# every uvicorn worker on the host through TOKEN_STORE_DB_PATH
+TOKEN_STORE_BACKEND = os.getenv("TOKEN_STORE_BACKEND", "memory").lower()
+TOKEN_STORE_DB_PATH = os.getenv("TOKEN_STORE_DB_PATH", "token_store.sqlite3")
+# Provider access tokens expire after an hour, as does our session JWT
+TOKEN_TTL_SECONDS = float(os.getenv("TOKEN_TTL_SECONDS", "3600"))
+TOKEN_STORE_MAX_ENTRIES = int(os.getenv("TOKEN_STORE_MAX_ENTRIES", "10000"))
+# How long a worker trusts its local copy of a shared token
+TOKEN_READ_CACHE_SECONDS = float(os.getenv("TOKEN_READ_CACHE_SECONDS", "5"))
+
+
+class TokenStore(ABC):
+    """Provider access tokens by user ID, for one provider (the namespace)."""
+
+    @abstractmethod
+    def get(self, user_id: str) -> Optional[str]:
+        """The user's token, or None if missing or expired."""
+
+    @abstractmethod
+    def set(self, user_id: str, token: str, ttl: float = None):
+        """Store the user's token for ttl seconds (the store's default if None)."""
+
+    @abstractmethod
+    def delete(self, user_id: str):
+        """Forget the user's token."""
+
+
+class MemoryTokenStore(TokenStore):
+    """In-process LRU with per-token expiry; invisible to other workers."""
+
+    def __init__(self, maxsize: int = TOKEN_STORE_MAX_ENTRIES, ttl: float = TOKEN_TTL_SECONDS):
+        self._tokens = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, user_id: str) -> Optional[str]:
+        return self._tokens.get(user_id)
+
+    def set(self, user_id: str, token: str, ttl: float = None):
+        self._tokens.set(user_id, token, ttl=ttl)
+
+    def delete(self, user_id: str):
+        self._tokens.pop(user_id)
+
+
+class SQLiteTokenStore(TokenStore):
+    """
+    Tokens in a SQLite file shared by every worker process on the host.
+    Reads go through a short-lived per-process cache, so a burst of requests
+    for one user costs a single query; a token written by another worker is
+    seen within read_cache_seconds.
+    """
+
+    def __init__(self, namespace: str, path: str = TOKEN_STORE_DB_PATH, ttl: float = TOKEN_TTL_SECONDS,
+                 read_cache_seconds: float = TOKEN_READ_CACHE_SECONDS, maxsize: int = TOKEN_STORE_MAX_ENTRIES):
+        self.namespace = namespace
+        self.ttl = ttl
+        self._cache = TTLCache(maxsize=maxsize, ttl=read_cache_seconds)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS user_tokens (
+                namespace TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                token TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (namespace, user_id)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_user_tokens_expires ON user_tokens (expires_at)")
+        self._conn.commit()
+
+    def get(self, user_id: str) -> Optional[str]:
+        cached = self._cache.get(user_id)
+        if cached is not None:
+            return cached
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT token, expires_at FROM user_tokens WHERE namespace = ? AND user_id = ?",
+                (self.namespace, user_id),
+            ).fetchone()
+        if row is None or row[1] <= time.time():
+            return None
+        # Never cache a token past its own expiry
+        self._cache.set(user_id, row[0], ttl=min(self._cache.ttl, row[1] - time.time()))
+        return row[0]
+
+    def set(self, user_id: str, token: str, ttl: float = None):
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO user_tokens (namespace, user_id, token, expires_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (namespace, user_id) DO UPDATE SET token = excluded.token, expires_at = excluded.expires_at
+                """,
+                (self.namespace, user_id, token, now + ttl),
+            )
+            # Expired rows are swept on write so the table stays bounded
+            self._conn.execute("DELETE FROM user_tokens WHERE expires_at <= ?", (now,))
+            self._conn.commit()
+        self._cache.set(user_id, token, ttl=min(self._cache.ttl, ttl))
+
+    def delete(self, user_id: str):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM user_tokens WHERE namespace = ? AND user_id = ?",
+                (self.namespace, user_id),
+            )
+            self._conn.commit()
+        self._cache.pop(user_id)
+
+
+_stores: dict[str, TokenStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_token_store(namespace: str) -> TokenStore:
+    """The process's token store for namespace, using TOKEN_STORE_BACKEND."""
+    with _stores_lock:
+        store = _stores.get(namespace)
+        if store is None:
+            if TOKEN_STORE_BACKEND == "sqlite":
+                store = SQLiteTokenStore(namespace)
+            elif TOKEN_STORE_BACKEND == "memory":
+                store = MemoryTokenStore()
+            else:
+                raise ValueError(f"Unknown TOKEN_STORE_BACKEND: {TOKEN_STORE_BACKEND}")
+            _stores[namespace] = store
+    return store